@@ -0,0 +1,237 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from midi_file import MIDIFile
+from midi_events import MetaEvent
+from midi_events import MIDIChannelNoteEvent
+from midi_events import MIDIChannelProgramChangeEvent
+from midi_events import MIDIChannelControlChangeEvent
+from midi_events import MIDIChannelRunningStatusEvent
+import midi_assm
+import midi_diss
+import music_parser
+from midi_track_merge import merge_tracks
+
+"""Time the toolchain on synthetic music and compare against saved baselines"""
+
+# -------------------------------------------------------------------------
+# Synthetic corpus
+
+def _end_of_track():
+    return MetaEvent(0,0x2F,[])
+
+def _make_midi(tracks,divis=256):
+    ret = MIDIFile()
+    ret.format = 1
+    ret.divis = divis
+    ret.tracks = tracks
+    return ret
+
+def dense_notes(rnd,num_notes,channel=0):
+    """One track of short, overlapping notes (two events per note)"""
+    track = [MIDIChannelProgramChangeEvent(0,channel,rnd.randrange(128))]
+    for _ in range(num_notes):
+        note = rnd.randrange(36,96)
+        track.append(MIDIChannelNoteEvent(rnd.choice((0,0,16,32)),channel,True,note,rnd.randrange(40,127)))
+        track.append(MIDIChannelNoteEvent(rnd.choice((16,32,64)),channel,False,note,0))
+    track.append(_end_of_track())
+    return track
+
+def corpus_dense(rnd,scale):
+    """A single very dense track"""
+    return _make_midi([dense_notes(rnd,20000*scale)])
+
+def corpus_many_tracks(rnd,scale):
+    """Many tracks (one per channel, and then some) of moderate density"""
+    return _make_midi([dense_notes(rnd,1000*scale,n%16) for n in range(32)])
+
+def corpus_long_meta(rnd,scale):
+    """Lots of long text and lyric meta events between the notes"""
+    track = []
+    for n in range(2000*scale):
+        text = ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz ') for _ in range(rnd.randrange(16,200)))
+        track.append(MetaEvent(rnd.randrange(64),rnd.choice((0x01,0x05,0x06)),text.encode()))
+        track.append(MIDIChannelNoteEvent(0,0,True,60+n%12,100))
+        track.append(MIDIChannelNoteEvent(32,0,False,60+n%12,0))
+    track.append(_end_of_track())
+    return _make_midi([track])
+
+def corpus_running_status(rnd,scale):
+    """Notes and controller sweeps written with running status"""
+    track = []
+    for _ in range(2000*scale):
+        first = MIDIChannelNoteEvent(0,0,True,rnd.randrange(36,96),100)
+        track.append(first)
+        for _ in range(7):
+            track.append(MIDIChannelRunningStatusEvent(rnd.randrange(32),first,[rnd.randrange(36,96),rnd.choice((0,100))]))
+        sweep = MIDIChannelControlChangeEvent(0,0,1,0)
+        track.append(sweep)
+        for v in range(1,8):
+            track.append(MIDIChannelRunningStatusEvent(4,sweep,[1,v*16]))
+    track.append(_end_of_track())
+    return _make_midi([track])
+
+CORPORA = {
+    'dense': corpus_dense,
+    'many_tracks': corpus_many_tracks,
+    'long_meta': corpus_long_meta,
+    'running_status': corpus_running_status,
+}
+
+def music_text(rnd,scale,num_tracks=4):
+    """A music_parser score with several tracks of random notes"""
+    lines = []
+    for t in range(num_tracks):
+        lines.append(f'Track {t}')
+        lines.append(f':Channel {t}')
+        lines.append(':Tempo 4=120')
+        for _ in range(200*scale):
+            notes = []
+            for _ in range(16):
+                notes.append(rnd.choice(('4','8','16','8.','4t','')) + rnd.choice('CDEFGAB') +
+                             rnd.choice(('','#','b')) + rnd.choice(('4','5')))
+            lines.append(' '.join(notes)+' |')
+    return '\n'.join(lines)
+
+# -------------------------------------------------------------------------
+# Measuring
+
+def measure(function,events,repeat):
+    """Time a function (best of several runs) and find its peak memory
+
+    Args:
+      function: called with no arguments
+      events (int): the number of events the function handles (for events/sec)
+      repeat (int): how many timed runs
+
+    Returns:
+      dict: seconds, events, events_per_sec, peak_bytes
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        if best is None or seconds<best:
+            best = seconds
+    # Memory is traced in a separate run (tracing slows everything down)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'seconds': best,
+        'events': events,
+        'events_per_sec': events/best if best else 0.0,
+        'peak_bytes': peak,
+    }
+
+def _count_events(tracks):
+    return sum(len(track) for track in tracks)
+
+def run_benchmarks(scale=1,repeat=3,seed=1234):
+    """Run every benchmark on every synthetic corpus
+
+    Returns:
+      dict: benchmark name to its measurement (see measure)
+    """
+    rnd = random.Random(seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name,make in CORPORA.items():
+            midi = make(rnd,scale)
+            events = _count_events(midi.tracks)
+            mid_file = os.path.join(tmp,name+'.mid')
+            txt_file = os.path.join(tmp,name+'.txt')
+            midi.write_file(mid_file)
+            with open(txt_file,'w') as f:
+                f.write(midi_diss.midi_to_text(midi))
+
+            results[f'parse_file/{name}'] = measure(lambda: MIDIFile().parse_file(mid_file),events,repeat)
+            results[f'write_file/{name}'] = measure(lambda: midi.write_file(mid_file),events,repeat)
+            results[f'file_to_midi/{name}'] = measure(lambda: midi_assm.file_to_midi(txt_file),events,repeat)
+
+            def diss():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    midi_diss.print_tracks(midi.tracks)
+            results[f'print_tracks/{name}'] = measure(diss,events,repeat)
+            results[f'merge_tracks/{name}'] = measure(lambda: merge_tracks(midi.tracks),events,repeat)
+
+    text = music_text(rnd,scale)
+    events = _count_events(music_parser.process_music(text).tracks)
+    results['process_music/score'] = measure(lambda: music_parser.process_music(text),events,repeat)
+    return results
+
+# -------------------------------------------------------------------------
+# Reporting
+
+def print_results(results,baseline=None):
+    """Print a table of the results (with the change from a baseline if given)"""
+    print("%-32s %10s %14s %12s %9s" % ('benchmark','seconds','events/sec','peak KB','change'))
+    for name,result in results.items():
+        change = ''
+        if baseline and name in baseline and baseline[name]['seconds']:
+            change = '%+.1f%%' % (100.0*(result['seconds']-baseline[name]['seconds'])/baseline[name]['seconds'])
+        print("%-32s %10.4f %14.0f %12.0f %9s" % (name,result['seconds'],result['events_per_sec'],
+                                                  result['peak_bytes']/1024,change))
+
+def save_results(results,filename):
+    """Save results as a JSON baseline"""
+    with open(filename,'w') as f:
+        json.dump({'python':sys.version,'results':results},f,indent=2,sort_keys=True)
+
+def load_results(filename):
+    """Load a JSON baseline"""
+    with open(filename) as f:
+        return json.load(f)['results']
+
+if __name__=='__main__':
+
+    # py -m benchmark [-scale N] [-repeat N] [-save base.json] [-compare base.json]
+
+    args = sys.argv[1:]
+    options = {'-scale':'1','-repeat':'3','-save':None,'-compare':None}
+    while args:
+        arg = args.pop(0)
+        if arg not in options:
+            raise Exception(f'Unknown option "{arg}"')
+        options[arg] = args.pop(0)
+
+    baseline = load_results(options['-compare']) if options['-compare'] else None
+    results = run_benchmarks(int(options['-scale']),int(options['-repeat']))
+    print_results(results,baseline)
+    if options['-save']:
+        save_results(results,options['-save'])
@@ -0,0 +1,122 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+
+"""A directory of cache files kept under a size limit (see track_cache and midi_cache)"""
+
+def write_atomic(filename,data):
+    """Write a file so that a reader never sees it half written
+
+    The data goes to a temporary file that then replaces the file.
+
+    Args:
+      filename (str): the file to write
+      data (bytes): the new content
+    """
+    tmp = filename+'.tmp'
+    with open(tmp,'wb') as f:
+        f.write(data)
+    os.replace(tmp,filename)
+
+class CacheDirectory:
+    """Cache files in one directory, least recently used deleted first
+
+    The files are the ones with the given extension. Using a file updates its
+    mtime (see touch), so the oldest mtime is the least recently used. The
+    total size is counted on the first write and then kept up to date.
+    """
+
+    def __init__(self,directory,extension,max_bytes):
+        """
+        Args:
+          directory (str): where the cache files go (made if missing)
+          extension (str): the extension of the cache files (like ".trk")
+          max_bytes (int): the most disk space the cache files may use
+        """
+        self.directory = directory
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.disk_bytes = None # Totaled on first write
+        os.makedirs(directory,exist_ok=True)
+
+    def filename(self,key):
+        """Return the cache file for a key"""
+        return os.path.join(self.directory,key+self.extension)
+
+    def touch(self,filename):
+        """Mark a cache file as recently used"""
+        os.utime(filename)
+
+    def write(self,filename,data):
+        """Write a cache file (atomically) and evict if the cache got too big
+
+        Args:
+          filename (str): the cache file (see filename)
+          data (bytes): the content
+        """
+        write_atomic(filename,data)
+        if self.disk_bytes is None:
+            self.disk_bytes = sum(size for _,size,_ in self.entries())
+        else:
+            self.disk_bytes += len(data)
+        if self.disk_bytes>self.max_bytes:
+            self.evict()
+
+    def remove(self,filename):
+        """Delete a cache file (if it is there)"""
+        try:
+            size = os.path.getsize(filename)
+            os.remove(filename)
+        except OSError:
+            return
+        if self.disk_bytes is not None:
+            self.disk_bytes -= size
+
+    def entries(self):
+        """Return (mtime, size, filename) of every cache file"""
+        ret = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                filename = os.path.join(self.directory,name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                ret.append((st.st_mtime,st.st_size,filename))
+        return ret
+
+    def evict(self):
+        """Delete the least recently used files until the cache fits in max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _,size,_ in entries)
+        for _,size,filename in entries:
+            if total<=self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+        self.disk_bytes = total
@@ -22,6 +22,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import os
 import sys
 
 from midi_file import MIDIFile
@@ -30,9 +31,70 @@ from midi_events import MIDIChannelNoteEvent
 from midi_events import MIDIChannelProgramChangeEvent
 from midi_events import MIDIChannelControlChangeEvent
 from midi_events import MIDIChannelPolyphonicKeyPressureEvent
+from midi_events import MIDIChannelPressureEvent
+from midi_events import MIDIChannelPitchBendEvent
 from midi_events import MIDIChannelRunningStatusEvent
+from midi_batch import find_jobs, is_up_to_date
+from midi_batch import run_batch, print_summary, parse_batch_args
+import midi_stats
+
+"""Build a binary MIDI file from its text representation (see midi_diss)"""
+
+# Each parser takes the delta, the fields after the event name, and the
+# previous channel event (for running status) and returns the new event.
+
+def _meta_event(delta,fields,previous):
+    return MetaEvent(delta,int(fields[0]),[int(d) for d in fields[1:]])
+
+def _program_change(delta,fields,previous):
+    return MIDIChannelProgramChangeEvent(delta,int(fields[0]),int(fields[1]))
+
+def _control_change(delta,fields,previous):
+    return MIDIChannelControlChangeEvent(delta,int(fields[0]),int(fields[1]),int(fields[2]))
+
+def _note_on(delta,fields,previous):
+    return MIDIChannelNoteEvent(delta,int(fields[0]),True,int(fields[1]),int(fields[2]))
+
+def _note_off(delta,fields,previous):
+    return MIDIChannelNoteEvent(delta,int(fields[0]),False,int(fields[1]),int(fields[2]))
+
+def _poly_key_press(delta,fields,previous):
+    return MIDIChannelPolyphonicKeyPressureEvent(delta,int(fields[0]),int(fields[1]),int(fields[2]))
+
+def _channel_pressure(delta,fields,previous):
+    return MIDIChannelPressureEvent(delta,int(fields[0]),int(fields[1]))
+
+def _pitch_bend(delta,fields,previous):
+    return MIDIChannelPitchBendEvent(delta,int(fields[0]),int(fields[1]))
+
+def _sysex_event(delta,fields,previous):
+    return SystemExclusiveEvent(delta,[int(d) for d in fields])
+
+def _running_status(delta,fields,previous):
+    return MIDIChannelRunningStatusEvent(delta,previous,[int(d) for d in fields])
+
+# Event name to (parser, True if the event can be continued by running status)
+EVENT_PARSERS = {
+    'MetaEvent'     : (_meta_event,False),
+    'ProgramChange' : (_program_change,True),
+    'ControlChange' : (_control_change,True),
+    'NoteOn'        : (_note_on,True),
+    'NoteOff'       : (_note_off,True),
+    'PolyKeyPress'  : (_poly_key_press,True),
+    'ChannelPressure': (_channel_pressure,True),
+    'PitchBend'     : (_pitch_bend,True),
+    'SysExEvent'    : (_sysex_event,False),
+    'RunningStatus' : (_running_status,False),
+}
 
 def file_to_midi(filename):
+    with midi_stats.phase('assemble') as stats_info:
+        ret = _file_to_midi(filename)
+        stats_info['bytes'] = os.path.getsize(filename)
+        stats_info['events'] = [evt for track in ret.tracks for evt in track] if midi_stats.enabled() else ()
+    return ret
+
+def _file_to_midi(filename):
     tracks = []
     previous = None
     with open(filename,'r') as f:
@@ -54,38 +116,15 @@ def file_to_midi(filename):
                 tracks.append([])
                 continue            
                 
-            line = line.split()
-            delta = int(line[0])
-            if line[1]=='MetaEvent':
-                data = []
-                for d in line[3:]:
-                    data.append(int(d))
-                evt = MetaEvent(delta,int(line[2]),data)
-                tracks[-1].append(evt)
-            elif line[1]=='ProgramChange':
-                evt = MIDIChannelProgramChangeEvent(delta,int(line[2]),int(line[3]))
-                tracks[-1].append(evt)
-                previous = evt
-            elif line[1]=='ControlChange':
-                evt = MIDIChannelControlChangeEvent(delta,int(line[2]),int(line[3]),int(line[4]))
-                tracks[-1].append(evt)
-                previous = evt
-            elif line[1]=='NoteOn':
-                evt = MIDIChannelNoteEvent(delta,int(line[2]),True,int(line[3]),int(line[4]))
-                tracks[-1].append(evt)
+            fields = line.split()
+            try:
+                parser,continues = EVENT_PARSERS[fields[1]]
+            except (KeyError,IndexError):
+                raise Exception(f'Invalid event "{fields}"')
+            evt = parser(int(fields[0]),fields[2:],previous)
+            tracks[-1].append(evt)
+            if continues:
                 previous = evt
-            elif line[1]=='NoteOff':
-                evt = MIDIChannelNoteEvent(delta,int(line[2]),False,int(line[3]),int(line[4]))
-                tracks[-1].append(evt)
-                previous = evt
-            elif line[1]=='RunningStatus':
-                data = []
-                for d in line[2:]:
-                    data.append(int(d))
-                evt = MIDIChannelRunningStatusEvent(delta,previous,data)
-                tracks[-1].append(evt)
-            else:
-                raise Exception(f'Invalid event "{line}"')
     ret = MIDIFile()
     ret.tracks = tracks
     ret.format = int(info['Format'])
@@ -95,6 +134,51 @@ def file_to_midi(filename):
 
     return ret
 
+def _assemble_job(job):
+    # Runs in a worker process. Errors come back as text so that one bad
+    # file does not stop the batch.
+    filename,out_filename = job
+    try:
+        midi = file_to_midi(filename)
+        midi.write_file(out_filename)
+        return filename,sum(len(track) for track in midi.tracks),None
+    except Exception as ex:
+        return filename,0,f'{type(ex).__name__}: {ex}'
+
+def assemble_batch(paths,out_dir=None,workers=None,incremental=False):
+    """Assemble many text files to MIDI files in parallel worker processes
+
+    Params:
+      paths (list): Files, directories (all .txt files), or glob patterns
+      out_dir (str): Where to write the .mid files (None for next to each input)
+      workers (int): Number of worker processes (None for one per CPU)
+      incremental (bool): Skip files whose .mid is newer than the text file
+
+    Returns:
+      dict: The summary from midi_batch.run_batch
+    """
+    found,failures = find_jobs(paths,('.txt',),out_dir,'.mid')
+    jobs = []
+    skipped = 0
+    for filename,out_filename in found:
+        if incremental and is_up_to_date(filename,out_filename):
+            skipped += 1
+        else:
+            os.makedirs(os.path.dirname(out_filename) or '.',exist_ok=True)
+            jobs.append((filename,out_filename))
+    return run_batch(_assemble_job,jobs,workers,skipped,failures)
+
 if __name__ == '__main__':
-    midi = file_to_midi(sys.argv[1])
-    midi.write_file(sys.argv[2])
+    # py -m midi_assm input.txt output.mid [-stats] [-profile FILE] [-tracemalloc FILE]
+    # py -m midi_assm -batch [-out DIR] [-workers N] [-incremental] PATH ...
+    argv,stats_options = midi_stats.extract_options(sys.argv)
+    with midi_stats.instrumented(stats_options):
+        if argv[1]=='-batch':
+            summary = assemble_batch(**parse_batch_args(argv[2:]))
+            print_summary(summary)
+            failed = bool(summary['failures'])
+        else:
+            midi = file_to_midi(argv[1])
+            midi.write_file(argv[2])
+            failed = False
+    sys.exit(1 if failed else 0)
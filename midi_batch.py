@@ -0,0 +1,214 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+"""Helpers for running the tools over many files in parallel"""
+
+def _walk_paths(paths,extensions):
+    # (filename, name relative to the directory that was scanned) for every
+    # file the paths name. A plain file is relative to its own directory and a
+    # glob match to the directory before the first wildcard.
+    for path in paths:
+        if os.path.isdir(path):
+            for root,_,files in os.walk(path):
+                for name in files:
+                    if name.lower().endswith(extensions):
+                        filename = os.path.join(root,name)
+                        yield filename,os.path.relpath(filename,path)
+        elif os.path.isfile(path):
+            yield path,os.path.basename(path)
+        else:
+            parts = path.replace('\\','/').split('/')
+            fixed = []
+            for part in parts[:-1]:
+                if any(c in part for c in '*?['):
+                    break
+                fixed.append(part)
+            root = '/'.join(fixed) or '.'
+            for p in glob.glob(path,recursive=True):
+                if os.path.isfile(p):
+                    yield p,os.path.relpath(p,root)
+
+def find_files(paths,extensions):
+    """Expand directories and glob patterns into a sorted list of files
+
+    Params:
+      paths (list): File names, directories (searched recursively), or globs
+      extensions (tuple): The file extensions to take from directories
+
+    Returns:
+      list: The file names
+    """
+    return sorted(set(filename for filename,_ in _walk_paths(paths,extensions)))
+
+def output_name(filename,out_dir,extension,relative_name=None):
+    """The output file for an input file: same name with a new extension
+
+    Params:
+      filename (str): The input file
+      out_dir (str): Where to put the output (None for next to the input)
+      extension (str): The new extension (like ".txt")
+      relative_name (str): The input's path under the directory it was found
+        in. The output goes to the same path under out_dir (None for just
+        the base name).
+
+    Returns:
+      str: The output file name
+    """
+    if not out_dir:
+        return os.path.splitext(filename)[0] + extension
+    if relative_name is None:
+        relative_name = os.path.basename(filename)
+    return os.path.join(out_dir,os.path.splitext(relative_name)[0] + extension)
+
+def find_jobs(paths,extensions,out_dir,extension):
+    """Find the input files and the output file for each
+
+    With an out_dir, each input's path under the directory it was found in
+    is kept under out_dir (songs/a/x.mid -> OUT/a/x.txt). Inputs that would
+    still write the same output (like x.mid and x.midi, or the same name in
+    two of the paths) are not run: all but the first are failures.
+
+    Params:
+      paths (list): File names, directories (searched recursively), or globs
+      extensions (tuple): The file extensions to take from directories
+      out_dir (str): Where to put the outputs (None for next to each input)
+      extension (str): The extension of the outputs (like ".txt")
+
+    Returns:
+      tuple: (list of (filename,out_filename), list of (filename,error))
+    """
+    found = {}
+    for filename,relative_name in _walk_paths(paths,extensions):
+        found.setdefault(filename,relative_name)
+    jobs = []
+    failures = []
+    inputs = set()
+    outputs = {}
+    for filename in sorted(found):
+        real = os.path.normcase(os.path.realpath(filename))
+        if real in inputs:
+            continue # The same file named two ways
+        inputs.add(real)
+        out_filename = output_name(filename,out_dir,extension,found[filename])
+        key = os.path.normcase(os.path.abspath(out_filename))
+        if key in outputs:
+            failures.append((filename,f'Same output file {out_filename} as {outputs[key]}'))
+            continue
+        outputs[key] = filename
+        jobs.append((filename,out_filename))
+    return jobs,failures
+
+def is_up_to_date(filename,out_filename):
+    """True if the output exists and is newer than the input"""
+    try:
+        return os.path.getmtime(out_filename)>=os.path.getmtime(filename)
+    except OSError:
+        return False
+
+def run_batch(job_function,jobs,workers=None,skipped=0,failures=()):
+    """Run jobs in parallel worker processes and time them
+
+    The job function runs in the worker. It must be a module-level function
+    that takes one job and returns (filename, event_count, error). The error
+    is None on success or a description of what went wrong. The job may
+    also return a fourth item: a list of problems that did not stop it (like
+    the parts of a file a lenient parse skipped).
+
+    Params:
+      job_function (function): The function to run on each job
+      jobs (list): The jobs
+      workers (int): Number of worker processes (None for one per CPU)
+      skipped (int): Number of files skipped before the run (for the summary)
+      failures (list): (filename,error) of files that failed before the run
+
+    Returns:
+      dict: files, skipped, events, seconds, failures (list of (filename,error)),
+            problems (list of (filename,problem)), files_per_sec, events_per_sec
+    """
+    start = time.perf_counter()
+    events = 0
+    failures = list(failures)
+    files = len(jobs) + len(failures)
+    problems = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(job_function,jobs,chunksize=16):
+                filename,count,error = result[:3]
+                if error:
+                    failures.append((filename,error))
+                if len(result)>3:
+                    problems.extend((filename,problem) for problem in result[3])
+                events += count
+    seconds = time.perf_counter() - start
+
+    return {
+        'files': files,
+        'skipped': skipped,
+        'events': events,
+        'seconds': seconds,
+        'failures': failures,
+        'problems': problems,
+        'files_per_sec': len(jobs)/seconds if seconds else 0.0,
+        'events_per_sec': events/seconds if seconds else 0.0,
+    }
+
+def print_summary(summary):
+    """Print the throughput summary of a batch run"""
+    for filename,problem in summary.get('problems',()):
+        print(f'SKIPPED PART OF {filename}: {problem}')
+    for filename,error in summary['failures']:
+        print(f'FAILED {filename}: {error}')
+    print("Files=%d Skipped=%d Events=%d Failures=%d Problems=%d Seconds=%.2f Files/sec=%.1f Events/sec=%.0f" % (
+        summary['files'],summary['skipped'],summary['events'],len(summary['failures']),len(summary.get('problems',())),
+        summary['seconds'],summary['files_per_sec'],summary['events_per_sec']))
+
+def parse_batch_args(args):
+    """Parse the batch command line options
+
+    [-out DIR] [-workers N] [-incremental] PATH ...
+
+    Params:
+      args (list): The arguments after "-batch"
+
+    Returns:
+      dict: paths, out_dir, workers, incremental
+    """
+    ret = {'paths':[],'out_dir':None,'workers':None,'incremental':False}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg=='-out':
+            ret['out_dir'] = args.pop(0)
+        elif arg=='-workers':
+            ret['workers'] = int(args.pop(0))
+        elif arg=='-incremental':
+            ret['incremental'] = True
+        else:
+            ret['paths'].append(arg)
+    return ret
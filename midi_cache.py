@@ -0,0 +1,230 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from midi_file import MIDIFile
+from midi_event_table import EventTable
+import midi_stats
+from cache_directory import CacheDirectory, write_atomic
+
+"""A cache of parsed MIDI files in a fast binary format
+
+A cache file holds the EventTable columns of every track exactly as they
+sit in memory, so loading is a few memory copies out of a memory-mapped
+file instead of decoding every event.
+
+Layout (little-endian):
+
+  header   "MIDC", version, flags, source size, source mtime (ns),
+           source SHA-256, format, divis, number of tracks
+  per track: number of rows, number of blob bytes
+  per track: the delta, status, channel, data1, data2, offset, and length
+             columns, then the blob
+"""
+
+CACHE_VERSION = 2 # 2: the decoder reads the data of every system message
+
+HEADER = struct.Struct('<4sHHQQ32sHHL')
+MTIME_OFFSET = 16 # Where the source mtime is in the header
+TRACK_HEADER = struct.Struct('<LL')
+
+# Flag bit: the columns were written on a big-endian machine
+FLAG_BIG_ENDIAN = 1
+
+EXTENSION = '.mcache'
+
+def _source_info(filename,with_hash=True):
+    st = os.stat(filename)
+    digest = b''
+    if with_hash:
+        h = hashlib.sha256()
+        with open(filename,'rb') as f:
+            for block in iter(lambda: f.read(1<<16),b''):
+                h.update(block)
+        digest = h.digest()
+    return st.st_size,st.st_mtime_ns,digest
+
+def pack_midi(midi,source_size,source_mtime,source_hash):
+    """Serialize a parsed MIDIFile (tracks as lists or EventTables)
+
+    Returns:
+      bytes: the cache file content
+    """
+    tables = [track if isinstance(track,EventTable) else EventTable.from_events(track) for track in midi.tracks]
+    flags = FLAG_BIG_ENDIAN if sys.byteorder=='big' else 0
+    parts = [HEADER.pack(b'MIDC',CACHE_VERSION,flags,source_size,source_mtime,source_hash,
+                         midi.format,midi.divis,len(tables))]
+    for table in tables:
+        parts.append(TRACK_HEADER.pack(len(table),len(table.blob)))
+    for table in tables:
+        for name in EventTable.COLUMNS:
+            parts.append(getattr(table,name).tobytes())
+        parts.append(bytes(table.blob))
+    return b''.join(parts)
+
+def unpack_midi(data,tables=False):
+    """Load a MIDIFile from cache file content
+
+    Args:
+      data: the content (bytes, mmap, or memoryview)
+      tables (bool): keep the tracks as EventTables (otherwise lists of events)
+
+    Returns:
+      tuple: (MIDIFile, header fields: size, mtime, hash)
+    """
+    magic,version,flags,size,mtime,digest,format,divis,num_tracks = HEADER.unpack_from(data,0)
+    if magic!=b'MIDC' or version!=CACHE_VERSION:
+        raise ValueError('Not a cache file of this version')
+    swap = bool(flags & FLAG_BIG_ENDIAN)!=(sys.byteorder=='big')
+    pos = HEADER.size
+    counts = []
+    for _ in range(num_tracks):
+        counts.append(TRACK_HEADER.unpack_from(data,pos))
+        pos += TRACK_HEADER.size
+
+    # A damaged (cut short or padded) file is caught here, before anything is copied
+    row_size = sum(getattr(EventTable(),name).itemsize for name in EventTable.COLUMNS)
+    expected = pos + sum(rows*row_size+blob_size for rows,blob_size in counts)
+    if len(data)!=expected:
+        raise ValueError(f'Cache file is {len(data)} bytes but its headers say {expected}')
+
+    midi = MIDIFile()
+    midi.format = format
+    midi.divis = divis
+    midi.tracks = []
+    view = memoryview(data)
+    try:
+        for rows,blob_size in counts:
+            table = EventTable()
+            for name in EventTable.COLUMNS:
+                col = getattr(table,name)
+                end = pos + rows*col.itemsize
+                col.frombytes(view[pos:end])
+                if swap:
+                    col.byteswap()
+                pos = end
+            table.blob.extend(view[pos:pos+blob_size])
+            pos += blob_size
+            midi.tracks.append(table if tables else table.to_events())
+    finally:
+        # No view may outlive this call (the data may be an mmap that is about to close)
+        view.release()
+    return midi,(size,mtime,digest)
+
+class MIDICache:
+    """Parsed MIDI files kept in cache files
+
+    Cache files go in a directory (named by a hash of the source's path) or,
+    with no directory, next to each source (song.mid.mcache). A cache file
+    is used only if the source has the same size and mtime as when it was
+    cached. If just the mtime changed, the source is hashed and the cache is
+    still used when the content is the same. With a directory, the total size
+    is kept under max_bytes by deleting the least recently used files.
+    """
+
+    def __init__(self,directory=None,max_bytes=256*1024*1024,verify_hash=False):
+        """
+        Args:
+          directory (str): where to keep the cache files (None for next to the sources)
+          max_bytes (int): the most disk space the directory may use
+          verify_hash (bool): always hash the source (not just when the mtime changed)
+        """
+        self.directory = directory
+        self.verify_hash = verify_hash
+        self.files = CacheDirectory(directory,EXTENSION,max_bytes) if directory else None
+        self.hits = 0
+        self.misses = 0
+
+    def cache_filename(self,filename):
+        """Return the cache file for a source file"""
+        if not self.directory:
+            return filename+EXTENSION
+        return self.files.filename(hashlib.sha256(os.path.abspath(filename).encode()).hexdigest())
+
+    def load(self,filename,tables=False,lenient=False):
+        """Return a parsed MIDI file (from the cache if it is still good)
+
+        A file that needed a lenient parse to load (see MIDIFile.parse_data)
+        is not cached, so its errors are reported every time.
+
+        Args:
+          filename (str): the MIDI file
+          tables (bool): keep the tracks as EventTables (otherwise lists of events)
+          lenient (bool): skip what cannot be decoded
+
+        Returns:
+          MIDIFile: the parsed file
+        """
+        cache_filename = self.cache_filename(filename)
+        size,mtime,_ = _source_info(filename,False)
+        midi = self._read(cache_filename,filename,size,mtime,tables)
+        if midi is not None:
+            self.hits += 1
+            return midi
+
+        self.misses += 1
+        midi = MIDIFile()
+        midi.parse_file(filename,tables=True,lenient=lenient)
+        if not midi.errors:
+            size,mtime,digest = _source_info(filename)
+            self._write(cache_filename,pack_midi(midi,size,mtime,digest))
+        if not tables:
+            midi.tracks = [track.to_events() for track in midi.tracks]
+        return midi
+
+    def _read(self,cache_filename,filename,size,mtime,tables):
+        try:
+            with open(cache_filename,'rb') as f:
+                with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+                    with midi_stats.phase('read',bytes=len(mm)):
+                        midi,(cached_size,cached_mtime,cached_hash) = unpack_midi(mm,tables)
+        except (OSError,ValueError,struct.error):
+            return None
+        if cached_size!=size:
+            return None
+        if cached_mtime!=mtime or self.verify_hash:
+            if _source_info(filename)[2]!=cached_hash:
+                return None
+            if cached_mtime!=mtime:
+                # Same content, newer mtime: record it so the next load skips the hash
+                with open(cache_filename,'r+b') as f:
+                    f.seek(MTIME_OFFSET)
+                    f.write(struct.pack('<Q',mtime))
+        if self.files:
+            self.files.touch(cache_filename)
+        return midi
+
+    def _write(self,cache_filename,data):
+        try:
+            if self.files:
+                self.files.write(cache_filename,data)
+            else:
+                write_atomic(cache_filename,data)
+        except OSError:
+            pass # Caching is best effort (a read-only library, for instance)
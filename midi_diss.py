@@ -22,44 +22,175 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import os
 import sys
+
 from midi_file import MIDIFile
+from midi_event_table import EventTable
+from midi_batch import find_jobs, is_up_to_date
+from midi_batch import run_batch, print_summary, parse_batch_args
+from midi_cache import MIDICache
+import midi_stats
 
 """Extract and print the data from a binary MIDI file"""
 
-def print_midi_as_text(filename):
+# File extensions picked up when a batch is given a directory
+MIDI_EXTENSIONS = ('.mid','.midi')
+
+def print_midi_as_text(filename,cache=None,lenient=False):
     """Prints the information from a MIDI file
     
     Params:
       filename (str): Name of the file      
+      cache (MIDICache): Where to look for the parsed file first (optional)
+      lenient (bool): Skip what cannot be decoded (and list it on stderr)
     """
-    midi = MIDIFile()
-    midi.parse_file(filename)        
-    print("NumTracks=%d Format=%d Division=%d" % (len(midi.tracks),midi.format,midi.divis))
+    if cache is not None:
+        # As EventTables a hit does not make the event objects (see EventTable.text_lines)
+        midi = cache.load(filename,tables=True,lenient=lenient)
+    else:
+        midi = MIDIFile()
+        midi.parse_file(filename,lenient=lenient)        
+    for error in midi.errors:
+        print(f'SKIPPED {filename}: {error}',file=sys.stderr)
+    text = midi_to_text(midi)
+    with midi_stats.phase('write',bytes=len(text)):
+        sys.stdout.write(text)
+
+def midi_to_text(midi):
+    """Return the text representation of a parsed MIDI file
+
+    Params:
+      midi (MIDIFile): The parsed MIDI file
+
+    Returns:
+      str: The header line and all the tracks
+    """
+    with midi_stats.phase('disassemble') as stats_info:
+        lines = ["NumTracks=%d Format=%d Division=%d" % (len(midi.tracks),midi.format,midi.divis)]
+        lines.extend(track_lines(midi.tracks))
+        lines.append('')
+        ret = '\n'.join(lines)
+        stats_info['bytes'] = len(ret)
+    return ret
+
+def track_lines(tracks):
+    """Generate the text lines for a list of tracks
+
+    Params:
+      tracks (list): The list of tracks
 
-    print_tracks(midi.tracks)    
+    Yields:
+      str: one line (without the newline)
+    """
+    tn = 0
+    for track in tracks:
+        yield ""
+        yield "Track %d ; %d events" % (tn,len(track))
+        if isinstance(track,EventTable):
+            yield from track.text_lines()
+        else:
+            for e in track:
+                yield str(e)
+        tn += 1
         
-def print_tracks(tracks):
+def print_tracks(tracks,out=None):
     """Print the events in a list of tracks from a MIDI file
     
     Params:
         tracks (list): The list of tracks
+        out: Where to print (stdout by default)
     """
+    out = out or sys.stdout
     tn = 0
     for track in tracks:
-        print(""        )
-        print("Track %d ; %d events" % (tn,len(track)))
-        print_track(track)
+        print(""        ,file=out)
+        print("Track %d ; %d events" % (tn,len(track)),file=out)
+        print_track(track,out)
         tn += 1
     
-def print_track(track):
+def print_track(track,out=None):
     """Print the events of a track from a MIDI file
     
     Params:
       track (list): the midi track      
+      out: Where to print (stdout by default)
     """        
-    for e in track:
-        print(str(e))
+    (out or sys.stdout).write(''.join(str(e)+'\n' for e in track))
+
+def disassemble_file(filename,out_filename,lenient=False,problems=None):
+    """Write the text representation of a MIDI file to a text file
+
+    The whole text is built in memory and written in one go.
+
+    Params:
+      filename (str): The MIDI file
+      out_filename (str): The text file to write
+      lenient (bool): Skip what cannot be decoded
+      problems (list): If given, what was skipped is added here
+
+    Returns:
+      int: The number of events in the file
+    """
+    midi = MIDIFile()
+    midi.parse_file(filename,lenient=lenient)
+    if problems is not None:
+        problems.extend(midi.errors)
+    text = midi_to_text(midi)
+    with open(out_filename,'w') as f:
+        f.write(text)
+    return sum(len(track) for track in midi.tracks)
+
+def _disassemble_job(job):
+    # Runs in a worker process. Errors come back as text so that one bad
+    # file does not stop the batch.
+    filename,out_filename,lenient = job
+    problems = []
+    try:
+        return filename,disassemble_file(filename,out_filename,lenient,problems),None,problems
+    except Exception as ex:
+        return filename,0,f'{type(ex).__name__}: {ex}',problems
+
+def disassemble_batch(paths,out_dir=None,workers=None,incremental=False,lenient=False):
+    """Disassemble many MIDI files in parallel worker processes
+
+    Params:
+      paths (list): Files, directories, or glob patterns
+      out_dir (str): Where to write the .txt files (None for next to each input)
+      workers (int): Number of worker processes (None for one per CPU)
+      incremental (bool): Skip files whose .txt is newer than the MIDI file
+      lenient (bool): Skip what cannot be decoded (reported as problems) instead of failing the file
+
+    Returns:
+      dict: The summary from midi_batch.run_batch
+    """
+    found,failures = find_jobs(paths,MIDI_EXTENSIONS,out_dir,'.txt')
+    jobs = []
+    skipped = 0
+    for filename,out_filename in found:
+        if incremental and is_up_to_date(filename,out_filename):
+            skipped += 1
+        else:
+            os.makedirs(os.path.dirname(out_filename) or '.',exist_ok=True)
+            jobs.append((filename,out_filename,lenient))
+    return run_batch(_disassemble_job,jobs,workers,skipped,failures)
 
-if __name__ == "__main__":    
-    print_midi_as_text(sys.argv[1])
+if __name__ == "__main__":
+    # py -m midi_diss input.mid [-cache DIR] [-lenient] [-stats] [-profile FILE] [-tracemalloc FILE]
+    # py -m midi_diss -batch [-out DIR] [-workers N] [-incremental] [-lenient] PATH ...
+    argv,stats_options = midi_stats.extract_options(sys.argv)
+    lenient = '-lenient' in argv
+    if lenient:
+        argv.remove('-lenient')
+    with midi_stats.instrumented(stats_options):
+        if argv[1]=='-batch':
+            summary = disassemble_batch(lenient=lenient,**parse_batch_args(argv[2:]))
+            print_summary(summary)
+            failed = bool(summary['failures'])
+        else:
+            cache = None
+            if '-cache' in argv:
+                cache = MIDICache(argv[argv.index('-cache')+1])
+            print_midi_as_text(argv[1],cache,lenient)
+            failed = False
+    sys.exit(1 if failed else 0)
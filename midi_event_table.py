@@ -0,0 +1,248 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from array import array
+
+from midi_events import MetaEvent, SystemExclusiveEvent
+from midi_events import MIDIChannelNoteEvent
+from midi_events import MIDIChannelProgramChangeEvent
+from midi_events import MIDIChannelControlChangeEvent
+from midi_events import MIDIChannelPolyphonicKeyPressureEvent
+from midi_events import MIDIChannelPressureEvent
+from midi_events import MIDIChannelPitchBendEvent
+from midi_events import MIDIChannelRunningStatusEvent
+
+"""A compact (struct-of-arrays) representation of a MIDI track"""
+
+class EventTable:
+    """The events of one track stored in parallel arrays
+
+    Every event is one row across the columns:
+      * delta   ticks to wait before the event
+      * status  the command: 0x80..0xE0 for channel events, 0xFF for meta
+                events, 0xF0..0xFE for SysEx events and 0x00 for running status
+      * channel the channel of a channel event
+      * data1   note, controller, program, pressure, the low 7 bits of a
+                pitch bend, or the meta type
+      * data2   velocity, value, or the high 7 bits of a pitch bend
+      * offset, length  the event's bytes in the blob (meta data, SysEx data,
+                or running status data bytes)
+
+    A row takes 16 bytes instead of a whole event object. The columns are
+    array.array objects, so they can be handed to NumPy without copying (see
+    as_numpy).
+
+    The table acts like a list of events: it can be iterated, indexed and
+    appended to. That lets MIDIFile parse straight into it and write straight
+    from it.
+    """
+
+    STATUS_RUNNING = 0x00
+    STATUS_META = 0xFF
+
+    COLUMNS = ('delta','status','channel','data1','data2','offset','length')
+
+    def __init__(self):
+        self.delta = array('I')
+        self.status = array('B')
+        self.channel = array('B')
+        self.data1 = array('B')
+        self.data2 = array('B')
+        self.offset = array('I')
+        self.length = array('I')
+        self.blob = bytearray()
+
+    @staticmethod
+    def from_events(events):
+        """Make a table from a list of events
+
+        Args:
+          events (list): the events of a track
+
+        Returns:
+          EventTable: the new table
+        """
+        ret = EventTable()
+        for event in events:
+            ret.append(event)
+        return ret
+
+    def to_events(self):
+        """Make a list of events from the table
+
+        Returns:
+          list: the events of the track
+        """
+        return list(self)
+
+    def _add_row(self,delta,status,channel=0,data1=0,data2=0,data=None):
+        self.delta.append(delta)
+        self.status.append(status)
+        self.channel.append(channel)
+        self.data1.append(data1)
+        self.data2.append(data2)
+        self.offset.append(len(self.blob))
+        if data:
+            self.blob.extend(data)
+            self.length.append(len(data))
+        else:
+            self.length.append(0)
+
+    def append(self,event):
+        """Add an event to the end of the table
+
+        Args:
+          event: any of the events from midi_events
+        """
+        if isinstance(event,MIDIChannelNoteEvent):
+            status = 0x90 if event.note_on else 0x80
+            self._add_row(event.delta,status,event.channel,event.note,event.velocity)
+        elif isinstance(event,MIDIChannelControlChangeEvent):
+            self._add_row(event.delta,0xB0,event.channel,event.controller,event.value)
+        elif isinstance(event,MIDIChannelProgramChangeEvent):
+            self._add_row(event.delta,0xC0,event.channel,event.value)
+        elif isinstance(event,MIDIChannelPolyphonicKeyPressureEvent):
+            self._add_row(event.delta,0xA0,event.channel,event.note,event.value)
+        elif isinstance(event,MIDIChannelPressureEvent):
+            self._add_row(event.delta,0xD0,event.channel,event.value)
+        elif isinstance(event,MIDIChannelPitchBendEvent):
+            lsb,msb = event.data_bytes()
+            self._add_row(event.delta,0xE0,event.channel,lsb,msb)
+        elif isinstance(event,MetaEvent):
+            self._add_row(event.delta,EventTable.STATUS_META,0,event.meta_type,0,event.meta_data)
+        elif isinstance(event,MIDIChannelRunningStatusEvent):
+            # The previous event is rebuilt from the rows before this one
+            self._add_row(event.delta,EventTable.STATUS_RUNNING,0,0,0,event.data)
+        elif isinstance(event,SystemExclusiveEvent):
+            self._add_row(event.delta,event.data[0],0,0,0,event.data)
+        else:
+            raise NotImplementedError(event)
+
+    def __len__(self):
+        return len(self.delta)
+
+    def __getitem__(self,index):
+        if index<0:
+            index += len(self)
+        if index<0 or index>=len(self):
+            raise IndexError('EventTable index out of range')
+        previous = None
+        if self.status[index]==EventTable.STATUS_RUNNING:
+            for i in range(index-1,-1,-1):
+                if 0x80<=self.status[i]<0xF0:
+                    previous = self._make_event(i,None)
+                    break
+        return self._make_event(index,previous)
+
+    def __iter__(self):
+        previous = None
+        for i in range(len(self)):
+            event = self._make_event(i,previous)
+            if 0x80<=self.status[i]<0xF0:
+                previous = event
+            yield event
+
+    # The text of the channel events (the same as their __str__ in midi_events)
+    TEXT_FORMATS = {
+        0x80: "%-7d NoteOff        %2d %3d %3d",
+        0x90: "%-7d NoteOn         %2d %3d %3d",
+        0xA0: "%-7d PolyKeyPress  %2d %3d %3d",
+        0xB0: "%-7d ControlChange  %2d %3d %3d",
+        0xC0: "%-7d ProgramChange  %2d %3d",
+        0xD0: "%-7d ChannelPressure %2d %3d",
+    }
+
+    def text_lines(self):
+        """Generate the midi-assembly text of each event (as str(event) would)
+
+        Channel events are formatted straight from the columns without making
+        the event objects. This is what makes disassembling a table quick.
+
+        Yields:
+          str: the text of one event
+        """
+        formats = EventTable.TEXT_FORMATS
+        blob = self.blob
+        rows = zip(self.delta,self.status,self.channel,self.data1,self.data2,self.offset,self.length)
+        for i,(delta,status,channel,data1,data2,offset,length) in enumerate(rows):
+            fmt = formats.get(status)
+            if fmt is not None:
+                if status==0xC0 or status==0xD0:
+                    yield fmt % (delta,channel,data1)
+                else:
+                    yield fmt % (delta,channel,data1,data2)
+            elif status==EventTable.STATUS_RUNNING and length==2:
+                yield "%-7d RunningStatus %3d %3d" % (delta,blob[offset],blob[offset+1])
+            elif status==EventTable.STATUS_RUNNING and length==1:
+                yield "%-7d RunningStatus %3d" % (delta,blob[offset])
+            elif status==0xE0:
+                yield "%-7d PitchBend     %2d %5d" % (delta,channel,(data2<<7) | data1)
+            else:
+                # Meta, SysEx and running status text does not need the previous event
+                yield str(self._make_event(i,None))
+
+    def _make_event(self,i,previous):
+        status = self.status[i]
+        delta = self.delta[i]
+        if status==0x90 or status==0x80:
+            return MIDIChannelNoteEvent(delta,self.channel[i],status==0x90,self.data1[i],self.data2[i])
+        if status==0xB0:
+            return MIDIChannelControlChangeEvent(delta,self.channel[i],self.data1[i],self.data2[i])
+        if status==0xC0:
+            return MIDIChannelProgramChangeEvent(delta,self.channel[i],self.data1[i])
+        if status==0xA0:
+            return MIDIChannelPolyphonicKeyPressureEvent(delta,self.channel[i],self.data1[i],self.data2[i])
+        if status==0xD0:
+            return MIDIChannelPressureEvent(delta,self.channel[i],self.data1[i])
+        if status==0xE0:
+            return MIDIChannelPitchBendEvent.from_data(delta,self.channel[i],self.data1[i],self.data2[i])
+        data = self.blob[self.offset[i]:self.offset[i]+self.length[i]]
+        if status==EventTable.STATUS_META:
+            return MetaEvent(delta,self.data1[i],data)
+        if status==EventTable.STATUS_RUNNING:
+            return MIDIChannelRunningStatusEvent(delta,previous,data)
+        return SystemExclusiveEvent(delta,data)
+
+    def nbytes(self):
+        """Return the number of bytes held by the columns and the blob"""
+        ret = len(self.blob)
+        for name in EventTable.COLUMNS:
+            col = getattr(self,name)
+            ret += len(col)*col.itemsize
+        return ret
+
+    def as_numpy(self):
+        """Return the columns as NumPy arrays (views of the same memory)
+
+        NumPy is only needed if this is called.
+
+        Returns:
+          dict: column name to numpy.ndarray
+        """
+        import numpy
+        ret = {}
+        for name in EventTable.COLUMNS:
+            col = getattr(self,name)
+            ret[name] = numpy.frombuffer(col,dtype=col.typecode)
+        return ret
@@ -26,7 +26,56 @@ SOFTWARE.
 All the different (supported) MIDI event types.
 """
 
-class MetaEvent:
+class MIDIEvent:
+    """Base of all the MIDI events
+
+    Events are small values. They use __slots__ (no per-instance dict), they
+    compare equal when they are the same type with the same fields, and they
+    can be used as dict keys and in sets.
+
+    Treat events as immutable: nothing in the toolchain changes an event after
+    it is made. Use with_delta to get the same event at a different time.
+    """
+
+    __slots__ = ()
+
+    def fields(self):
+        """Return the values of the event's fields (in __slots__ order)
+
+        Returns:
+          tuple: the field values
+        """
+        return tuple(getattr(self,name) for name in self.__slots__)
+
+    def with_delta(self,new_delta):
+        """Return the same event with a new time delta
+
+        Args:
+          new_delta (int): the new tick delta
+
+        Returns:
+          event: the new event (of the same type)
+        """
+        raise NotImplementedError(self)
+
+    def make_copy(self,new_delta):
+        """Old name for with_delta"""
+        return self.with_delta(new_delta)
+
+    def __eq__(self,other):
+        return type(self) is type(other) and self.fields()==other.fields()
+
+    def __ne__(self,other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self).__name__,self.fields()))
+
+    def __repr__(self):
+        args = ', '.join(f'{name}={getattr(self,name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({args})'
+
+class MetaEvent(MIDIEvent):
     """MIDI Meta Events
 
     Meta events have a type and a list of data bytes.
@@ -54,20 +103,22 @@ class MetaEvent:
         0x7F: 'Sequencer specific event',
     }
     
+    __slots__ = ('delta','meta_type','meta_data')
+    
     def __init__(self, delta, meta_type, meta_data):
         """Create a new MetaEvent
         
         Args:
           delta (float):      ticks to wait before event
           meta_type (int):    the type-byte of the meta event 
-          meta_data (int []): the data bytes of the meta event        
+          meta_data (bytes):  the data bytes of the meta event (any list of ints)
 
         """        
         self.delta = delta
         self.meta_type = meta_type
-        self.meta_data = meta_data       
+        self.meta_data = bytes(meta_data)
         
-    def make_copy(self,new_delta):
+    def with_delta(self,new_delta):
         """Make a copy of the MetaEvent but with a new time delta
 
         This is used by the track-merger to move events around in time.
@@ -79,8 +130,7 @@ class MetaEvent:
           MetaEvent: the new MetaEvent
 
         """        
-        ret = MetaEvent(new_delta,self.meta_type,self.meta_data)
-        return ret
+        return MetaEvent(new_delta,self.meta_type,self.meta_data)
         
     def __str__(self):
         """Returns a text representation of the MetaEvent
@@ -107,15 +157,25 @@ class MetaEvent:
             ds = ds + "%3d " % x
         return "%-7d MetaEvent     %3d %s%s" % (self.delta,self.meta_type,ds,com)
 
-class SystemExclusiveEvent:
+class SystemExclusiveEvent(MIDIEvent):
     """A message intended for a specific piece of hardware
+
+    The data is the status byte followed by the message bytes. For 0xF0
+    (SysEx) and 0xF7 (escaped bytes) the file also holds the length of the
+    message, which is not kept here (it is the length of the data minus one).
+    Other system messages (0xF1-0xFE) are the status and their fixed data.
+
+    For example:
+      * DELTA SysExEvent 240 67 16 76 0 0 126 0 247
     """
 
+    __slots__ = ('delta','data')
+
     def __init__(self,delta,data):
         self.delta = delta
-        self.data = data
+        self.data = bytes(data)
 
-    def make_copy(self,new_delta):
+    def with_delta(self,new_delta):
         return SystemExclusiveEvent(new_delta,self.data)
 
     def __str__(self):
@@ -125,7 +185,7 @@ class SystemExclusiveEvent:
         return "%-7d SysExEvent    %s" % (self.delta,ds)
 
 
-class MIDIChannelNoteEvent:
+class MIDIChannelNoteEvent(MIDIEvent):
     """MIDI Channel Note Event
 
     A note being pressed (on) or released (off) with a velocity value either way.
@@ -136,6 +196,8 @@ class MIDIChannelNoteEvent:
     
     """    
     
+    __slots__ = ('delta','channel','note_on','note','velocity')
+    
     def __init__(self, delta, channel, note_on, note, velocity):
         self.channel = channel
         self.delta = delta
@@ -143,9 +205,8 @@ class MIDIChannelNoteEvent:
         self.note = note
         self.velocity = velocity
         
-    def make_copy(self,new_delta):
-        ret = MIDIChannelNoteEvent(new_delta,self.channel,self.note_on,self.note,self.velocity)
-        return ret
+    def with_delta(self,new_delta):
+        return MIDIChannelNoteEvent(new_delta,self.channel,self.note_on,self.note,self.velocity)
         
     def __str__(self):
         if self.note_on:
@@ -154,7 +215,7 @@ class MIDIChannelNoteEvent:
             event_type = 'NoteOff       '
         return "%-7d %s %2d %3d %3d" %(self.delta,event_type,self.channel,self.note,self.velocity)
 
-class MIDIChannelProgramChangeEvent:
+class MIDIChannelProgramChangeEvent(MIDIEvent):
     """MIDI Channel Program Change Event
 
     This usually means assigning a different instrument to the channel.
@@ -164,19 +225,20 @@ class MIDIChannelProgramChangeEvent:
 
     """
 
+    __slots__ = ('delta','channel','value')
+
     def __init__(self, delta, channel, value):
         self.channel = channel
         self.delta = delta
         self.value = value        
         
-    def make_copy(self,new_delta):
-        ret = MIDIChannelProgramChangeEvent(new_delta,self.channel,self.value)
-        return ret
+    def with_delta(self,new_delta):
+        return MIDIChannelProgramChangeEvent(new_delta,self.channel,self.value)
         
     def __str__(self):        
         return "%-7d ProgramChange  %2d %3d" %(self.delta, self.channel, self.value)
 
-class MIDIChannelControlChangeEvent:
+class MIDIChannelControlChangeEvent(MIDIEvent):
     """MIDI Channel Control Change Event
 
     This usually means devices like pedals and levers have changed.
@@ -188,20 +250,21 @@ class MIDIChannelControlChangeEvent:
 
     """
 
+    __slots__ = ('delta','channel','controller','value')
+
     def __init__(self, delta, channel, controller, value):
         self.channel = channel
         self.controller = controller
         self.delta = delta
         self.value = value        
         
-    def make_copy(self,new_delta):
-        ret = MIDIChannelControlChangeEvent(new_delta,self.channel,self.controller, self.value)
-        return ret
+    def with_delta(self,new_delta):
+        return MIDIChannelControlChangeEvent(new_delta,self.channel,self.controller, self.value)
         
     def __str__(self):        
         return "%-7d ControlChange  %2d %3d %3d" %(self.delta, self.channel,self.controller,self.value)
     
-class MIDIChannelPolyphonicKeyPressureEvent:
+class MIDIChannelPolyphonicKeyPressureEvent(MIDIEvent):
     """MIDI Channel Polyphonic Key Pressure Event (Aftertouch)   
 
     For example:
@@ -209,35 +272,119 @@ class MIDIChannelPolyphonicKeyPressureEvent:
 
     """
 
+    __slots__ = ('delta','channel','note','value')
+
     def __init__(self, delta, channel, note, value):
         self.channel = channel
         self.note = note
         self.delta = delta
         self.value = value        
         
-    def make_copy(self,new_delta):
-        ret = MIDIChannelPolyphonicKeyPressureEvent(new_delta,self.channel,self.note, self.value)
-        return ret
+    def with_delta(self,new_delta):
+        return MIDIChannelPolyphonicKeyPressureEvent(new_delta,self.channel,self.note, self.value)
         
     def __str__(self):        
         return "%-7d PolyKeyPress  %2d %3d %3d" %(self.delta, self.channel,self.note,self.value)
 
+
+class MIDIChannelPressureEvent(MIDIEvent):
+    """MIDI Channel Pressure Event (Aftertouch for the whole channel)
+
+    For example:
+      * DELTA ChannelPressure CH VALUE
+
+    """
+
+    __slots__ = ('delta','channel','value')
+
+    def __init__(self, delta, channel, value):
+        self.channel = channel
+        self.delta = delta
+        self.value = value
+
+    def with_delta(self,new_delta):
+        return MIDIChannelPressureEvent(new_delta,self.channel,self.value)
+
+    def __str__(self):
+        return "%-7d ChannelPressure %2d %3d" %(self.delta, self.channel, self.value)
+
+class MIDIChannelPitchBendEvent(MIDIEvent):
+    """MIDI Channel Pitch Bend Event
+
+    The value is 14 bits: 0 to 16383 with 8192 meaning no bend. On the wire
+    it is two data bytes, the low 7 bits first.
+
+    For example:
+      * DELTA PitchBend CH VALUE
+
+    """
+
+    CENTER = 8192
+
+    __slots__ = ('delta','channel','value')
+
+    def __init__(self, delta, channel, value):
+        self.channel = channel
+        self.delta = delta
+        self.value = value
+
+    @staticmethod
+    def from_data(delta,channel,lsb,msb):
+        """Make the event from its two data bytes"""
+        return MIDIChannelPitchBendEvent(delta,channel,(msb<<7) | lsb)
+
+    def data_bytes(self):
+        """Return the two data bytes (low 7 bits first)"""
+        return (self.value & 0x7F,(self.value>>7) & 0x7F)
+
+    def with_delta(self,new_delta):
+        return MIDIChannelPitchBendEvent(new_delta,self.channel,self.value)
+
+    def __str__(self):
+        return "%-7d PitchBend     %2d %5d" %(self.delta, self.channel, self.value)
            
-class MIDIChannelRunningStatusEvent:
+class MIDIChannelRunningStatusEvent(MIDIEvent):
     """MIDI Channel Running Status Event
     
     MIDI allows the same events on the same channel to skip the command byte. Data bytes
     simply injected behind the data bytes of the last command.
     
     """
+    __slots__ = ('delta','previous_event','data')
+
     def __init__(self, delta, previous_event, data):
         self.delta = delta
         self.previous_event = previous_event
-        self.data = data
+        self.data = bytes(data)
         
-    def make_copy(self,new_delta):
-        ret = MIDIChannelRunningStatusEvent(new_delta,self.previous_event,self.data)
-        return ret        
+    def with_delta(self,new_delta):
+        return MIDIChannelRunningStatusEvent(new_delta,self.previous_event,self.data)
+
+    def get_expanded_event(self):
+        """Make the full event this running-status event stands for
+
+        The data bytes are applied to the command (and channel) of the previous
+        event. Once tracks are merged the "previous" event may belong to another
+        track, so the track-merger needs the complete event.
+
+        Returns:
+          event: the full event with this event's delta
+
+        """
+        prev = self.previous_event
+        if isinstance(prev,MIDIChannelNoteEvent):
+            return MIDIChannelNoteEvent(self.delta,prev.channel,prev.note_on,self.data[0],self.data[1])
+        if isinstance(prev,MIDIChannelControlChangeEvent):
+            return MIDIChannelControlChangeEvent(self.delta,prev.channel,self.data[0],self.data[1])
+        if isinstance(prev,MIDIChannelPolyphonicKeyPressureEvent):
+            return MIDIChannelPolyphonicKeyPressureEvent(self.delta,prev.channel,self.data[0],self.data[1])
+        if isinstance(prev,MIDIChannelProgramChangeEvent):
+            return MIDIChannelProgramChangeEvent(self.delta,prev.channel,self.data[0])
+        if isinstance(prev,MIDIChannelPressureEvent):
+            return MIDIChannelPressureEvent(self.delta,prev.channel,self.data[0])
+        if isinstance(prev,MIDIChannelPitchBendEvent):
+            return MIDIChannelPitchBendEvent.from_data(self.delta,prev.channel,self.data[0],self.data[1])
+        raise Exception(f'Cannot expand running status after {type(prev)}')
         
     def __str__(self):
         ds = " ".join("%3d" % (x,) for x in self.data)
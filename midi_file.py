@@ -22,20 +22,71 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from itertools import islice
+
 from midi_events import MetaEvent, SystemExclusiveEvent
 from midi_events import MIDIChannelNoteEvent
 from midi_events import MIDIChannelProgramChangeEvent
 from midi_events import MIDIChannelControlChangeEvent
 from midi_events import MIDIChannelPolyphonicKeyPressureEvent
+from midi_events import MIDIChannelPressureEvent
+from midi_events import MIDIChannelPitchBendEvent
 from midi_events import MIDIChannelRunningStatusEvent
+from midi_event_table import EventTable
+from midi_tempo import TempoMap, absolute_ticks
+import midi_stats
+
+# Variable-length (VLQ) encodings of the deltas seen so far. Most deltas
+# are small and repeat a lot, so each is only encoded once.
+_DELTA_CACHE = {}
+
+# The largest value a 4-byte VLQ can hold
+MAX_DELTA = 0x0FFFFFFF
+
+def encode_delta(delta):
+    """Return the variable-length (VLQ) encoding of a delta
+
+    Args:
+      delta (int): the value to encode
+
+    Returns:
+      bytes: 1 to 4 bytes, 7 bits each, high bit set on all but the last
+    """
+    ret = _DELTA_CACHE.get(delta)
+    if ret is None:
+        value = int(delta)
+        if value<0 or value>MAX_DELTA:
+            raise ValueError(f'Delta {delta} is outside the range of a MIDI delta (0 to {MAX_DELTA})')
+        buf = [value&0x7F]
+        value = value >> 7
+        while value:
+            buf.append((value&0x7F) | 0x80)
+            value = value >> 7
+        buf.reverse()
+        ret = bytes(buf)
+        if len(_DELTA_CACHE)<0x4000:
+            _DELTA_CACHE[delta] = ret
+    return ret
 
 class MIDIDataCursor:
 
+    """
+    A read/write position over MIDI data.
+
+    For reading, the data is any bytes-like object (bytes, memoryview, mmap).
+    Chunks can be pulled out with read_view() without copying. For writing,
+    the data is a bytearray that grows in place.
+    """
+
     def __init__(self,data=None,pos=0):
-        if data:
+        if data is not None:
             self.data = data
         else:
-            self.data = []
+            self.data = bytearray()
         self.pos = pos
 
     def read(self,size):
@@ -43,8 +94,29 @@ class MIDIDataCursor:
         self.pos += size
         return ret
 
+    def read_view(self,size):
+        """Return the next size bytes as a zero-copy memoryview"""
+        ret = memoryview(self.data)[self.pos:self.pos+size]
+        if len(ret)!=size:
+            raise Exception(f'Expected {size} bytes at {self.pos} but only {len(ret)} remain')
+        self.pos += size
+        return ret
+
+    def read_struct(self,fmt):
+        """Decode a fixed-size record at the cursor with a struct format
+
+        Args:
+          fmt (struct.Struct): the (big-endian) record format
+
+        Returns:
+          tuple: the decoded values
+        """
+        ret = fmt.unpack_from(self.data,self.pos)
+        self.pos += fmt.size
+        return ret
+
     def write(self,data):
-        self.data = self.data + list(data)
+        self.data += data
     
     def read_byte(self):
         ret = self.data[self.pos]
@@ -58,45 +130,104 @@ class MIDIDataCursor:
         self.data.append(value)
 
     def read_two_bytes(self):
-        return (self.read_byte()<<8) | self.read_byte()    
+        ret = int.from_bytes(self.data[self.pos:self.pos+2],'big')
+        self.pos += 2
+        return ret
 
     def write_two_bytes(self,value):
-        a = (value>>8) & 0xFF
-        b = value & 0xFF
-        self.write_byte(a)
-        self.write_byte(b)
+        self.data += (value & 0xFFFF).to_bytes(2,'big')
 
     def read_four_bytes(self):
-        return (self.read_two_bytes()<<16) | self.read_two_bytes()
+        ret = int.from_bytes(self.data[self.pos:self.pos+4],'big')
+        self.pos += 4
+        return ret
 
     def write_four_bytes(self,value):
-        a = (value>>16) & 0xFFFF
-        b = value & 0xFFFF
-        self.write_two_bytes(a)
-        self.write_two_bytes(b)
+        self.data += (value & 0xFFFFFFFF).to_bytes(4,'big')
 
     def read_delta(self):
-        ret = 0
-        while True:
+        # At most 4 bytes (see MAX_DELTA): a longer one means the data is damaged
+        v = self.read_byte()
+        if v<0x80:
+            return v
+        ret = v & 0x7F
+        for _ in range(3):
             v = self.read_byte()
             ret = (ret << 7) | (v & 0x7F)
             if v<0x80:
                 return ret
+        raise Exception(f'Variable-length value longer than 4 bytes at {self.pos-4}')
 
     def write_delta(self,delta):
-        buf = []
-        while True:
-            if delta<0x80:
-                buf.append(delta)
-                break
-            buf.append(delta&0x7F)
-            delta = delta >> 7       
-        for i in range(len(buf)-1,-1,-1):
-            d = buf[i]
-            if i!=0:
-                d = d | 0x80
-            self.write_byte(d)
-        
+        self.data += encode_delta(delta)
+
+
+class MIDIStreamCursor:
+
+    """
+    A read position over MIDI data in an open file.
+
+    The data is pulled from the file a block at a time as the cursor moves,
+    so decoding the start of a chunk only reads the start of the chunk. The
+    position counts the bytes consumed since the cursor was made.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self,f,size):
+        """
+        Args:
+          f: a binary file positioned at the first byte to read
+          size (int): the number of bytes the cursor may read
+        """
+        self.f = f
+        self.remaining = size
+        self.buf = b''
+        self.buf_pos = 0
+        self.pos = 0
+
+    def _fill(self):
+        if self.remaining<=0:
+            raise Exception(f'Read past the end of the chunk at {self.pos}')
+        size = min(self.remaining,MIDIStreamCursor.BLOCK_SIZE)
+        self.buf = self.f.read(size)
+        if len(self.buf)!=size:
+            raise Exception(f'Expected {size} bytes at {self.pos} but the file ended')
+        self.remaining -= size
+        self.buf_pos = 0
+
+    def read(self,size):
+        ret = b''
+        while len(ret)<size:
+            if self.buf_pos>=len(self.buf):
+                self._fill()
+            take = self.buf[self.buf_pos:self.buf_pos+size-len(ret)]
+            self.buf_pos += len(take)
+            ret += take
+        self.pos += size
+        return ret
+
+    def read_byte(self):
+        if self.buf_pos>=len(self.buf):
+            self._fill()
+        ret = self.buf[self.buf_pos]
+        self.buf_pos += 1
+        self.pos += 1
+        return ret
+
+    def read_delta(self):
+        # At most 4 bytes (see MAX_DELTA): a longer one means the data is damaged
+        v = self.read_byte()
+        if v<0x80:
+            return v
+        ret = v & 0x7F
+        for _ in range(3):
+            v = self.read_byte()
+            ret = (ret << 7) | (v & 0x7F)
+            if v<0x80:
+                return ret
+        raise Exception(f'Variable-length value longer than 4 bytes at {self.pos-4}')
+
 
 class MIDIFile:
 
@@ -114,215 +245,617 @@ class MIDIFile:
     <v_time> + <event>    
     """
 
+    # Chunk headers
+    HEADER_CHUNK = struct.Struct('>4sLHHH') # "MThd", length, format, numTracks, divis
+    TRACK_CHUNK = struct.Struct('>4sL')     # "MTrk", length
+
     def __init__(self):                
         self.format = None
         self.divis = None        
         self.tracks = None
+        # Set by open_file for lazy reading
+        self.filename = None
+        self.track_chunks = None # (file offset of the events, size) of each MTrk
+        # What was skipped or repaired by a lenient parse (one line each)
+        self.errors = []
+
+    def write_file(self,filename,running_status=False,report=None):
+        """Write this MIDI file to disk
+
+        Args:
+          filename (str): the name of the MIDI file to write
+          running_status (bool): compress the tracks with running status (see encode_track)
+          report (list): if given, the number of bytes saved in each track is appended
+        """
+        with open(filename,'wb') as f:
+            self.write_to(f,running_status,report)
+            f.flush()
 
-    def write_file(self,filename):
-
-        cursor = MIDIDataCursor()
-        cursor.write(b'MThd')
-
-        cursor.write_four_bytes(6) # Length of the header record (always 6 bytes)
-
-        cursor.write_two_bytes(self.format) # How to interpret the tracks (likely a 01 for multi-track-song)
-        cursor.write_two_bytes(len(self.tracks))
-        cursor.write_two_bytes(self.divis)
-
-        for track in self.tracks:
-            track_data = MIDIDataCursor()
-            for event in track:
-
-                # Every event starts with a delta
-                track_data.write_delta(event.delta)
+    def write_to(self,f,running_status=False,report=None):
+        """Write this MIDI file to any binary file-like object
 
-                if isinstance(event,MetaEvent):
-                    track_data.write_byte(0xFF)
-                    track_data.write_byte(event.meta_type)
-                    track_data.write_delta(len(event.meta_data))
-                    track_data.write_bytes(event.meta_data)
+        The whole file is encoded in memory and handed over in one write. This
+        works for open files, io.BytesIO buffers, socket files, etc.
 
-                elif isinstance(event,MIDIChannelProgramChangeEvent):
-                    track_data.write_byte(0xC0 | event.channel)                    
-                    track_data.write_byte(event.value)
+        Args:
+          f: an object with a write(bytes) method
+          running_status (bool): compress the tracks with running status (see encode_track)
+          report (list): if given, the number of bytes saved in each track is appended
+        """
+        data = self.to_bytes(running_status,report)
+        with midi_stats.phase('write',bytes=len(data)):
+            f.write(data)
 
-                elif isinstance(event,MIDIChannelControlChangeEvent):
-                    track_data.write_byte(0xB0 | event.channel)
-                    track_data.write_byte(event.controller)
-                    track_data.write_byte(event.value)
+    def to_bytes(self,running_status=False,report=None):
+        """Encode this MIDI file
 
-                elif isinstance(event,MIDIChannelRunningStatusEvent):
-                    track_data.write_bytes(event.data)                                        
+        Args:
+          running_status (bool): compress the tracks with running status (see encode_track)
+          report (list): if given, the number of bytes saved in each track is appended
 
-                elif isinstance(event,MIDIChannelNoteEvent):
-                    if event.note_on:
-                        track_data.write_byte(0x90 | event.channel)
-                    else:
-                        track_data.write_byte(0x80 | event.channel)
-                    track_data.write_byte(event.note)
-                    track_data.write_byte(event.velocity)
+        Returns:
+          bytes: the standard MIDI file data
+        """
+        track_datas = []
+        for track in self.tracks:
+            with midi_stats.phase('encode_track',events=track) as info:
+                track_data,saved = self.encode_track(track,running_status)
+                info['bytes'] = len(track_data)
+            if report is not None:
+                report.append(saved)
+            track_datas.append(track_data)
+        return MIDIFile.pack_file(self.format,self.divis,track_datas)
+
+    @staticmethod
+    def pack_file(format,divis,track_datas):
+        """Put the header and the already-encoded tracks together
+
+        Args:
+          format (int): the MIDI file format
+          divis (int): the time division (ticks per beat)
+          track_datas (list): the encoded events of each track (see encode_track)
+
+        Returns:
+          bytes: the standard MIDI file data
+        """
+        cursor = MIDIDataCursor()
+        cursor.write(MIDIFile.HEADER_CHUNK.pack(b'MThd',6,format,len(track_datas),divis))
+        for track_data in track_datas:
+            cursor.write(MIDIFile.TRACK_CHUNK.pack(b'MTrk',len(track_data)))
+            cursor.write(track_data)
+        return bytes(cursor.data)
+
+    def encode_track(self,track,running_status=False):
+        """Encode the events of one track (the body of an MTrk chunk)
+
+        Normally every channel event is written with its status byte (unless the
+        track has explicit running status events). With running_status, the
+        status byte is left off whenever it repeats the last one written, and
+        NoteOff events with velocity 0 are written as NoteOn velocity 0 so that
+        they can share the NoteOn status. Meta and SysEx events cancel running
+        status (as the standard requires).
+
+        Args:
+          track (list): the events of the track
+          running_status (bool): compress the track with running status
+
+        Returns:
+          tuple: (bytearray of the encoded events, number of bytes saved against
+                  encoding without running_status)
+        """
+        track_data = MIDIDataCursor()
+        last_status = None
+        saved = 0
+        for event in track:
+
+            # Every event starts with a delta
+            track_data.write_delta(event.delta)
+
+            # The track already left this status byte off (it counts as saved
+            # only if running_status leaves off one the track did not)
+            explicit = isinstance(event,MIDIChannelRunningStatusEvent)
+            if explicit:
+                if not running_status:
+                    track_data.write_bytes(event.data)
+                    continue
+                # Re-encode from the full event
+                event = event.get_expanded_event()
+
+            if isinstance(event,MetaEvent):
+                track_data.write_byte(0xFF)
+                track_data.write_byte(event.meta_type)
+                track_data.write_delta(len(event.meta_data))
+                track_data.write_bytes(event.meta_data)
+                last_status = None
+                continue
 
-                else:                                        
-                    raise NotImplementedError(event)                               
+            if isinstance(event,MIDIChannelProgramChangeEvent):
+                status = 0xC0 | event.channel
+                data = (event.value,)
+
+            elif isinstance(event,MIDIChannelControlChangeEvent):
+                status = 0xB0 | event.channel
+                data = (event.controller,event.value)
+
+            elif isinstance(event,MIDIChannelNoteEvent):
+                if event.note_on or (running_status and event.velocity==0):
+                    status = 0x90 | event.channel
+                else:
+                    status = 0x80 | event.channel
+                data = (event.note,event.velocity)
+
+            elif isinstance(event,MIDIChannelPolyphonicKeyPressureEvent):
+                status = 0xA0 | event.channel
+                data = (event.note,event.value)
+
+            elif isinstance(event,MIDIChannelPressureEvent):
+                status = 0xD0 | event.channel
+                data = (event.value,)
+
+            elif isinstance(event,MIDIChannelPitchBendEvent):
+                status = 0xE0 | event.channel
+                data = event.data_bytes()
+
+            elif isinstance(event,SystemExclusiveEvent):
+                track_data.write_byte(event.data[0])
+                if event.data[0]==0xF0 or event.data[0]==0xF7:
+                    track_data.write_delta(len(event.data)-1)
+                track_data.write_bytes(event.data[1:])
+                last_status = None
+                continue
 
-            cursor.write(b'MTrk')
-            cursor.write_four_bytes(len(track_data.data))
-            cursor.write_bytes(track_data.data)            
+            else:                                        
+                raise NotImplementedError(event)                               
 
-        with open(filename,'wb') as f:
-            f.write(bytes(cursor.data))
-            f.flush()
-
-    def parse_file(self,filename):
-        # Load the entire file as a list of integers
+            if status==last_status:
+                if not explicit:
+                    saved += 1
+            else:
+                track_data.write_byte(status)
+                if explicit:
+                    saved -= 1
+                if running_status:
+                    last_status = status
+            track_data.write_bytes(data)
+
+        return track_data.data,saved
+
+    def parse_file(self,filename,use_mmap=False,tables=False,lenient=False):
+        """Parse a MIDI file into this object
+
+        The file is read as bytes (or memory-mapped for very large files) and
+        decoded through zero-copy views. No event keeps a reference to the
+        file data.
+
+        Args:
+          filename (str): the name of the MIDI file
+          use_mmap (bool): map the file into memory instead of reading it
+          tables (bool): store each track as a compact EventTable instead of a list
+          lenient (bool): skip what cannot be decoded (see parse_data)
+        """
         with open(filename,'rb') as f:
-            data = list(f.read())        
-
+            # An empty file cannot be mapped (it is read instead, and fails as not MIDI)
+            if use_mmap and os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+                    data = memoryview(mm)
+                    try:
+                        self.parse_data(data,tables,lenient)
+                        failed = False
+                    except Exception:
+                        # Views into the map live on in the traceback and would
+                        # stop it from closing. Drop them and decode a copy below
+                        # to raise the real error.
+                        failed = True
+                    data.release()
+                if not failed:
+                    return
+                f.seek(0)
+            with midi_stats.phase('read') as info:
+                data = f.read()
+                info['bytes'] = len(data)
+            self.parse_data(data,tables,lenient)
+
+    def parse_data(self,data,tables=False,lenient=False):
+        """Parse MIDI data (any bytes-like object) into this object
+
+        Normally any problem in the data raises an exception. In lenient mode
+        as much as possible is kept instead, and each problem is added to
+        self.errors:
+          * chunks that are not "MTrk" are skipped
+          * a track that cannot be decoded keeps the events before the problem
+            (and gets an END OF TRACK)
+          * a file that ends early keeps the tracks it has
+
+        Args:
+          data (bytes): the contents of a MIDI file
+          tables (bool): store each track as a compact EventTable instead of a list
+          lenient (bool): skip what cannot be decoded instead of failing
+        """
         cursor = MIDIDataCursor(data,0)
+        self.errors = []
         
-        self.format,num_tracks,self.divis = self.read_header_chunk(cursor)
+        with midi_stats.phase('header',bytes=MIDIFile.HEADER_CHUNK.size):
+            self.format,num_tracks,self.divis = self.read_header_chunk(cursor)
 
         self.tracks = []    
-        for _ in range(num_tracks):    
-            events = self.read_track_chunk(cursor)
-            self.tracks.append(events)    
+        while len(self.tracks)<num_tracks:
+            if not lenient:
+                with midi_stats.phase('decode_track') as info:
+                    start = cursor.pos
+                    events = self.read_track_chunk(cursor,EventTable() if tables else None)
+                    info['bytes'] = cursor.pos - start
+                    info['events'] = events
+                self.tracks.append(events)    
+                continue
+
+            if cursor.pos+MIDIFile.TRACK_CHUNK.size>len(data):
+                self.errors.append(f'The file ends after {len(self.tracks)} of {num_tracks} tracks')
+                break
+            dat,size = cursor.read_struct(MIDIFile.TRACK_CHUNK)
+            if dat!=b'MTrk':
+                self.errors.append(f'Skipped a {bytes(dat)!r} chunk of {size} bytes at {cursor.pos-MIDIFile.TRACK_CHUNK.size}')
+                cursor.pos += size
+                continue
+            if cursor.pos+size>len(data):
+                self.errors.append(f'Track {len(self.tracks)} is cut short ({len(data)-cursor.pos} of {size} bytes)')
+                size = len(data)-cursor.pos
+            with midi_stats.phase('decode_track') as info:
+                events = self.decode_chunk_lenient(cursor.read_view(size),EventTable() if tables else None)
+                info['bytes'] = size
+                info['events'] = events
+            self.tracks.append(events)
+
+    def decode_chunk_lenient(self,chunk,ret=None):
+        """Decode the events of a track chunk, keeping what comes before any problem
+
+        Problems are added to self.errors.
+
+        Args:
+          chunk: the bytes of the chunk after its header
+          ret: where to append the events (a new list by default, or an EventTable)
+
+        Returns:
+          the events of the track (always ending with END OF TRACK)
+        """
+        if ret is None:
+            ret = []
+        track_number = len(self.tracks)
+        try:
+            for evt in self.decode_events(MIDIDataCursor(chunk,0),len(chunk)):
+                ret.append(evt)
+        except IndexError:
+            self.errors.append(f'Track {track_number}: the data ends in the middle of an event (kept {len(ret)} events)')
+        except Exception as ex:
+            self.errors.append(f'Track {track_number}: {type(ex).__name__}: {ex} (kept {len(ret)} events)')
+        if not ret or not isinstance(ret[-1],MetaEvent) or ret[-1].meta_type!=0x2F:
+            if ret and any(isinstance(evt,MetaEvent) and evt.meta_type==0x2F for evt in ret):
+                self.errors.append(f'Track {track_number}: events after END OF TRACK')
+            else:
+                self.errors.append(f'Track {track_number}: missing END OF TRACK')
+            ret.append(MetaEvent(0,0x2F,[]))
+        return ret
         
+    def open_file(self,filename,lenient=False):
+        """Read the header and find the track chunks without decoding them
+
+        Only the chunk headers are read: the chunk lengths are used to seek
+        from one track to the next. The tracks are decoded later (and only if
+        needed) with iter_track.
+
+        Args:
+          filename (str): the name of the MIDI file
+          lenient (bool): skip chunks that are not "MTrk" (and note them in self.errors)
+        """
+        self.errors = []
+        self.filename = filename
+        self.track_chunks = []
+        with open(filename,'rb') as f:
+            head = f.read(MIDIFile.HEADER_CHUNK.size)
+            cursor = MIDIDataCursor(head)
+            self.format,num_tracks,self.divis = self.read_header_chunk(cursor)
+            offset = cursor.pos
+            while len(self.track_chunks)<num_tracks:
+                f.seek(offset)
+                dat,size = MIDIFile.TRACK_CHUNK.unpack(f.read(MIDIFile.TRACK_CHUNK.size))
+                offset += MIDIFile.TRACK_CHUNK.size
+                if dat!=b'MTrk':
+                    if not lenient:
+                        raise Exception("Missing 'MTrk' header")
+                    self.errors.append(f'Skipped a {dat!r} chunk of {size} bytes')
+                    offset += size
+                    continue
+                self.track_chunks.append((offset,size))
+                offset += size
+
+    def iter_track(self,track_number):
+        """Decode the events of one track lazily (see open_file)
+
+        The file is read a block at a time as events are asked for. Stopping
+        early (after the track name, for instance) reads only the start of
+        the chunk.
+
+        Args:
+          track_number (int): the index of the track
+
+        Yields:
+          the events of the track
+        """
+        offset,size = self.track_chunks[track_number]
+        with open(self.filename,'rb') as f:
+            f.seek(offset)
+            last = None
+            for evt in self.decode_events(MIDIStreamCursor(f,size),size):
+                last = evt
+                yield evt
+        if not isinstance(last,MetaEvent) or last.meta_type!=0x2F:
+            raise Exception('Missing END OF TRACK Meta Event')
+
+    def iter_events(self,filename):
+        """Walk the tracks of a MIDI file lazily
+
+        For example, to get the track names:
+
+          for track_number,events in midi.iter_events(filename):
+              first = next(events)
+
+        A track whose events are never asked for is never read.
+
+        Args:
+          filename (str): the name of the MIDI file
+
+        Yields:
+          tuple: (track_number, generator of the track's events)
+        """
+        self.open_file(filename)
+        for track_number in range(len(self.track_chunks)):
+            yield track_number,self.iter_track(track_number)
+
+    # Meta events whose latest value is carried to the start of a slice:
+    # track name, instrument name, tempo, time signature, key signature
+    SLICE_META_TYPES = (0x03,0x04,0x51,0x58,0x59)
+
+    def slice(self,start,end,seconds=False):
+        """Make a new MIDIFile with just the music from start to end
+
+        The window is [start, end): events on the start tick are kept and
+        events on the end tick are not. Each track is cut on its own using an
+        index of its absolute tick times (a binary search finds the window).
+
+        The state in effect at the start is put back at tick 0 of the slice:
+        the latest track name, tempo, time and key signature, the controllers,
+        program, pitch bend and pressure of each channel, and the notes still held (struck again
+        with their original velocity). Notes still sounding at the end are
+        released on the end tick, and every track gets an END OF TRACK there.
+
+        Args:
+          start: where the window starts (ticks, or seconds if seconds is True)
+          end: where the window ends
+          seconds (bool): True if start and end are in seconds (using the file's tempo map)
+
+        Returns:
+          MIDIFile: the slice
+        """
+        if seconds:
+            tempo_map = TempoMap.from_midi(self)
+            start = round(tempo_map.seconds_to_tick(start))
+            end = round(tempo_map.seconds_to_tick(end))
+        if end<start:
+            raise Exception(f'Slice ends ({end}) before it starts ({start})')
+
+        ret = MIDIFile()
+        ret.format = self.format
+        ret.divis = self.divis
+        ret.tracks = [MIDIFile._slice_track(track,start,end) for track in self.tracks]
+        return ret
+
+    @staticmethod
+    def _slice_track(track,start,end):
+        ticks = absolute_ticks(track)
+        first = bisect_left(ticks,start)
+        last = bisect_left(ticks,end)
+
+        metas = {}       # meta type -> latest event
+        controllers = {} # (channel, controller) -> latest event (in the order they were set)
+        programs = {}    # channel -> latest event
+        bends = {}       # (channel, event type) -> latest pitch bend or channel pressure
+        held = {}        # (channel, note) -> the NoteOn event
+
+        def track_state(event):
+            if isinstance(event,MIDIChannelNoteEvent):
+                key = (event.channel,event.note)
+                if event.note_on and event.velocity:
+                    held[key] = event
+                else:
+                    held.pop(key,None)
+            elif isinstance(event,MIDIChannelControlChangeEvent):
+                # Channel mode messages (120-127) are actions, not settings
+                if event.controller<120:
+                    key = (event.channel,event.controller)
+                    controllers.pop(key,None)
+                    controllers[key] = event
+            elif isinstance(event,MIDIChannelProgramChangeEvent):
+                programs[event.channel] = event
+            elif isinstance(event,(MIDIChannelPitchBendEvent,MIDIChannelPressureEvent)):
+                bends[(event.channel,type(event))] = event
+
+        events = iter(track)
+        for event in islice(events,first):
+            if isinstance(event,MetaEvent):
+                if event.meta_type in MIDIFile.SLICE_META_TYPES:
+                    metas[event.meta_type] = event
+            elif isinstance(event,MIDIChannelRunningStatusEvent):
+                track_state(event.get_expanded_event())
+            else:
+                track_state(event)
+
+        # Put back the state at the cut
+        ret = [event.with_delta(0) for event in metas.values()]
+        ret.extend(event.with_delta(0) for event in controllers.values())
+        ret.extend(event.with_delta(0) for event in programs.values())
+        ret.extend(event.with_delta(0) for event in bends.values())
+        ret.extend(event.with_delta(0) for event in held.values())
+
+        tick = start
+        last_status = None # The last full channel event in the window
+        for i,event in zip(range(first,last),events):
+            if isinstance(event,MetaEvent) and event.meta_type==0x2F:
+                continue
+            if isinstance(event,MIDIChannelRunningStatusEvent):
+                expanded = event.get_expanded_event()
+                if event.previous_event is not last_status:
+                    # The status it runs on was cut off (or another came between)
+                    last_status = event.previous_event
+                    event = expanded
+            else:
+                expanded = event
+                if isinstance(event,SystemExclusiveEvent):
+                    last_status = None
+                elif not isinstance(event,MetaEvent):
+                    last_status = event
+            track_state(expanded)
+            ret.append(event.with_delta(ticks[i]-tick))
+            tick = ticks[i]
+
+        # Release what is still sounding
+        delta = end-tick
+        for channel,note in held:
+            ret.append(MIDIChannelNoteEvent(delta,channel,False,note,0))
+            delta = 0
+        ret.append(MetaEvent(delta,0x2F,[]))
+        return ret
+
     def read_header_chunk(self,cursor):
-        dat = cursor.read(4)
+        dat,en,format,numTracks,divis = cursor.read_struct(MIDIFile.HEADER_CHUNK)
         if dat!=b'MThd':
             raise Exception("Missing 'MThd' header") 
-        en = cursor.read_four_bytes()
-        if en!=6:
+        if en<6:
             raise Exception("Expected header length to be 6 bytes but got "+str(en))
-        format = cursor.read_two_bytes()
-        numTracks = cursor.read_two_bytes()
-        divis = cursor.read_two_bytes()
+        # Later versions of the standard may add to the header: skip the rest
+        cursor.pos += en-6
         return format,numTracks,divis
 
-    def read_track_chunk(self,cursor):
+    def read_track_chunk(self,cursor,ret=None):
+        """Decode the events of the next MTrk chunk
+
+        Args:
+          cursor (MIDIDataCursor): positioned at the chunk header
+          ret: where to append the events (a new list by default, or an EventTable)
+
+        Returns:
+          the events of the track
+        """
         
-        ret = [] # The events of this track
+        if ret is None:
+            ret = [] # The events of this track
         
         # Check the header
-        dat = cursor.read(4)
+        dat,trackSize = cursor.read_struct(MIDIFile.TRACK_CHUNK)
         if dat!=b'MTrk':
             raise Exception("Missing 'MTrk' header")
-        trackSize = cursor.read_four_bytes()    
-                
-        end_of_track = cursor.pos+trackSize
+
+        # Decode the events from a view of just this chunk
+        cursor = MIDIDataCursor(cursor.read_view(trackSize),0)
+        end_of_track = trackSize
+
+        for evt in self.decode_events(cursor,end_of_track):
+            ret.append(evt)
+
+        if not ret or not isinstance(ret[-1],MetaEvent) or ret[-1].meta_type!=0x2F:
+            raise Exception('Missing END OF TRACK Meta Event')
+
+        return ret
+
+    def decode_events(self,cursor,end_of_track):
+        """Decode events from the cursor up to the end of the track
+
+        This is a generator. Events are decoded only as they are asked for.
+
+        Every status byte is handled (see CHANNEL_EVENTS and SYSTEM_DATA_SIZES).
+        Running status continues any channel event. Meta and system events
+        do not cancel it: many files rely on that even though the standard
+        says SysEx should.
+
+        Args:
+          cursor: a MIDIDataCursor (or MIDIStreamCursor) at the first event
+          end_of_track (int): the cursor position where the track ends
+
+        Yields:
+          the events of the track
+        """
 
         # Information about the last command for the "running status" feature        
         previous = None
         previous_size = 0
 
+        read_byte = cursor.read_byte
+        read_delta = cursor.read_delta
+        channel_events = CHANNEL_EVENTS
+
         while cursor.pos<end_of_track:       
                         
             # Evert event starts with a var-length delta
-            delta = cursor.read_delta()        
+            delta = read_delta()        
 
-            d = cursor.read_byte()
+            d = read_byte()
 
             # MIDI lets you skip the status byte of the event and use the last given one.
             # This makes for a shorter file without all the repeated "note on" and "note off".
             # If the upper bit is NOT set, then this uses the last event type.
             if d<128: # This is data ... running status shortcut
-                if not isinstance(previous,MIDIChannelNoteEvent) and not isinstance(previous,MIDIChannelControlChangeEvent):
-                    # I've only seen these two kinds of continuations, but there might be others. Add
-                    # them if you see them.
-                    raise NotImplemented(f'UNSUPPORTED PREVIOUS {type(previous)}')
-                data = [d] # The first byte counts as data
-                for _ in range(previous_size-1):
-                    data.append(cursor.read_byte())                
-                evt = MIDIChannelRunningStatusEvent(delta,previous,data)
-                ret.append(evt) 
+                if previous is None:
+                    raise Exception(f'Running status with no channel event before it at {cursor.pos-1}')
+                # The first byte counts as data
+                data = bytes((d,read_byte())) if previous_size==2 else bytes((d,))
+                yield MIDIChannelRunningStatusEvent(delta,previous,data)
                 continue
         
             # FF -- META events            
-            if(d==0xFF):
+            if d==0xFF:
                 meta_type = cursor.read_byte()
                 meta_len = cursor.read_delta()
-                meta_data = cursor.read(meta_len)                
-                evt = MetaEvent(delta,meta_type,meta_data)
-                ret.append(evt)                
+                yield MetaEvent(delta,meta_type,cursor.read(meta_len))
                 continue
 
-            command = d>>4 # Upper 4 bits
+            # F0 and F7 -- SysEx (and escaped bytes) with a length
+            if d==0xF0 or d==0xF7:
+                length = cursor.read_delta()
+                yield SystemExclusiveEvent(delta,bytes((d,))+cursor.read(length))
+                continue
 
-            # Fx -- System Exclusive events
-            if command==15: # (but wasn't 0xFF) System Exclusive
-                if d==0b11110000 or d==0b11110010 or d==0b11110011:
-                    # There are others. Add them as you see them. Some have
-                    # multiple data bytes.
-                    raise NotImplemented(d)
-                evt = SystemExclusiveEvent(delta,[d])                
-                ret.append(evt)
+            # F1-FE -- other system messages with fixed data
+            if d>=0xF0:
+                yield SystemExclusiveEvent(delta,bytes((d,))+cursor.read(SYSTEM_DATA_SIZES[d]))
                 continue
             
             # This must be a channel event
-                        
-            channel = d&0xF # Lower 4 bits
-                
-            if command==8: # Note Off Event
-                note = cursor.read_byte()
-                velocity = cursor.read_byte()
-                evt = MIDIChannelNoteEvent(delta,channel,False,note,velocity)
-                previous = evt
-                previous_size = 2
-                ret.append(evt)                          
-                
-            elif command==9: # Note On Event
-                # MIDI allows NoteOn-velocity-0 to mean NoteOff
-                note = cursor.read_byte()
-                velocity = cursor.read_byte()
-                evt = MIDIChannelNoteEvent(delta,channel,True,note,velocity)
-                previous = evt
-                previous_size = 2
-                ret.append(evt)                           
-                
-            elif command==10: # Polyphonic Key Pressure
-                note = cursor.read_byte()
-                value = cursor.read_byte()
-                evt = MIDIChannelPolyphonicKeyPressureEvent(delta,channel,note,value)
-                previous = evt
-                previous_size = 2
-                ret.append(evt)                
-
-            elif command==11: # Control Change
-                cntr = cursor.read_byte()
-                value = cursor.read_byte()
-                evt = MIDIChannelControlChangeEvent(delta,channel,cntr,value)
-                previous = evt
-                previous_size = 2
-                ret.append(evt)                
-                
-            elif command==12: # Program Change
-                program = cursor.read_byte()
-                evt = MIDIChannelProgramChangeEvent(delta,channel,program)
-                previous = evt
-                ret.append(evt)                
-                
-            elif command==13: # Channel Pressure
-                # Add if you need it.
-                raise NotImplemented()
-
-            elif command==14: # Pitch Bend Change
-                # Add if you need it.
-                raise NotImplemented()
-
-            elif command==15: # (but wasn't 0xFF) System Exclusive
-                if d==0b11110000 or d==0b11110010 or d==0b11110011:
-                    raise NotImplemented()
-                evt = SystemExclusiveEvent(delta,[d])                
-                ret.append(evt)
-                #print(delta,hex(old_pos),evt)
-
-            else:
-                # It isn't really possible to get here. We checked all
-                # possibilities. But just in case.
-                raise Exception('Unknown command '+str(command))                    
-        
-        if not isinstance(ret[-1],MetaEvent) or ret[-1].meta_type!=0x2F:
-            raise Exception('Missing END OF TRACK Meta Event')
-
-        return ret
+            size,make_event = channel_events[d>>4]
+            data1 = read_byte()
+            data2 = read_byte() if size==2 else 0
+            previous = make_event(delta,d&0xF,data1,data2)
+            previous_size = size
+            yield previous
+
+        if cursor.pos>end_of_track:
+            raise Exception(f'The last event runs {cursor.pos-end_of_track} bytes past the end of the track')
+
+# Channel events by command (the upper 4 bits of the status byte):
+# (number of data bytes, function to make the event from delta, channel, data1, data2)
+CHANNEL_EVENTS = {
+    0x8: (2,lambda delta,channel,d1,d2: MIDIChannelNoteEvent(delta,channel,False,d1,d2)),
+    0x9: (2,lambda delta,channel,d1,d2: MIDIChannelNoteEvent(delta,channel,True,d1,d2)), # Velocity 0 means off
+    0xA: (2,lambda delta,channel,d1,d2: MIDIChannelPolyphonicKeyPressureEvent(delta,channel,d1,d2)),
+    0xB: (2,lambda delta,channel,d1,d2: MIDIChannelControlChangeEvent(delta,channel,d1,d2)),
+    0xC: (1,lambda delta,channel,d1,d2: MIDIChannelProgramChangeEvent(delta,channel,d1)),
+    0xD: (1,lambda delta,channel,d1,d2: MIDIChannelPressureEvent(delta,channel,d1)),
+    0xE: (2,MIDIChannelPitchBendEvent.from_data),
+}
+
+# Data bytes after the system messages that have no length (F0, F7 and FF do)
+SYSTEM_DATA_SIZES = {
+    0xF1: 1, # MIDI time code quarter frame
+    0xF2: 2, # Song position pointer
+    0xF3: 1, # Song select
+    0xF4: 0, 0xF5: 0, # Undefined
+    0xF6: 0, # Tune request
+    0xF8: 0, 0xF9: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFD: 0, 0xFE: 0, # Real-time
+}
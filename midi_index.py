@@ -0,0 +1,426 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import base64
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from midi_file import MIDIFile
+from midi_events import MIDIChannelNoteEvent
+from midi_events import MIDIChannelProgramChangeEvent
+from midi_events import MIDIChannelRunningStatusEvent
+from midi_tempo import TempoMap
+from midi_track_merge import merge_tracks
+from midi_batch import find_files
+from midi_diss import MIDI_EXTENSIONS
+
+"""A searchable index of a library of MIDI files
+
+Each file is parsed once and summed up: the programs used on each channel,
+the channels, the note range, the tempos, the length in seconds, and the
+melodic interval n-grams of each channel. The summaries are saved in one
+index file. Updating the index only parses the files that are new or whose
+content changed (by mtime and size first, then by hash).
+"""
+
+# 2: files are keyed by their absolute path
+INDEX_VERSION = 2
+
+# Melodies are fingerprinted by runs of this many intervals
+NGRAM_SIZE = 3
+
+DRUM_CHANNEL = 9
+
+def file_hash(filename):
+    """Return the SHA-256 hex digest of a file's content"""
+    h = hashlib.sha256()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(1<<16),b''):
+            h.update(block)
+    return h.hexdigest()
+
+def interval_ngrams(notes,size=NGRAM_SIZE):
+    """Return the fingerprints of every run of intervals in a melody
+
+    Each interval (clamped to -64..63 semitones) takes 7 bits of the
+    fingerprint, so two runs have the same fingerprint only if they have the
+    same intervals.
+
+    Args:
+      notes (list): the note numbers of the melody in order
+      size (int): the number of intervals in a run
+
+    Returns:
+      set: the fingerprints (ints)
+    """
+    intervals = [min(max(b-a,-64),63)+64 for a,b in zip(notes,notes[1:])]
+    ret = set()
+    for i in range(len(intervals)-size+1):
+        fingerprint = 0
+        for interval in intervals[i:i+size]:
+            fingerprint = (fingerprint<<7) | interval
+        ret.add(fingerprint)
+    return ret
+
+def summarize(midi):
+    """Sum up the content of a parsed MIDI file
+
+    The melody of a channel is its highest NoteOn at each tick (drums on
+    channel 10 are left out).
+
+    Args:
+      midi (MIDIFile): the music
+
+    Returns:
+      dict: programs ([channel, program] pairs), channels, note_min, note_max,
+            tempos (BPM), duration (seconds), ngrams (fingerprints), format,
+            tracks, events
+    """
+    programs = set()
+    channels = set()
+    note_min = 128
+    note_max = -1
+    melodies = {} # channel -> [note, ...]
+    last_tick = {} # channel -> tick of the last melody note
+    tick = 0
+    events = 0
+    for event in merge_tracks(midi.tracks):
+        events += 1
+        tick += event.delta
+        if isinstance(event,MIDIChannelRunningStatusEvent):
+            event = event.get_expanded_event()
+        if isinstance(event,MIDIChannelProgramChangeEvent):
+            programs.add((event.channel,event.value))
+            channels.add(event.channel)
+        elif isinstance(event,MIDIChannelNoteEvent) and event.note_on and event.velocity:
+            channels.add(event.channel)
+            note_min = min(note_min,event.note)
+            note_max = max(note_max,event.note)
+            if event.channel==DRUM_CHANNEL:
+                continue
+            melody = melodies.setdefault(event.channel,[])
+            if last_tick.get(event.channel)==tick:
+                melody[-1] = max(melody[-1],event.note)
+            else:
+                melody.append(event.note)
+                last_tick[event.channel] = tick
+        elif hasattr(event,'channel'):
+            channels.add(event.channel)
+
+    tempo_map = TempoMap.from_midi(midi)
+    ngrams = set()
+    for melody in melodies.values():
+        ngrams.update(interval_ngrams(melody))
+    return {
+        'format': midi.format,
+        'tracks': len(midi.tracks),
+        'events': events,
+        'programs': sorted(programs),
+        'channels': sorted(channels),
+        'note_min': note_min if note_max>=0 else None,
+        'note_max': note_max if note_max>=0 else None,
+        'tempos': sorted(set(round(60_000_000/tempo,2) for tempo in tempo_map.tempos)),
+        'duration': round(tempo_map.duration(),3),
+        'ngrams': sorted(ngrams),
+    }
+
+def index_name(filename):
+    """The name a file is kept under in the index: its absolute, normalized path
+
+    So the same file is one entry however it was named (songs/x.mid,
+    songs/../songs/x.mid, or from another working directory).
+    """
+    return os.path.normpath(os.path.abspath(filename))
+
+def _covered(filename,paths):
+    """True if a file is one of the paths, under one of them, or matches one of them (as a glob)"""
+    filename = index_name(filename)
+    for path in paths:
+        path = index_name(path)
+        if filename==path or filename.startswith(os.path.join(path,'')):
+            return True
+        if fnmatch.fnmatch(filename,path):
+            return True
+    return False
+
+def _index_job(job):
+    # Runs in a worker process: (filename, size, mtime, hash) -> entry
+    filename,size,mtime,digest = job
+    entry = {'size':size,'mtime':mtime,'hash':digest,'error':None,'problems':[]}
+    try:
+        midi = MIDIFile()
+        midi.parse_file(filename,tables=True,lenient=True)
+        entry['problems'] = midi.errors
+        entry.update(summarize(midi))
+    except Exception as ex:
+        entry['error'] = f'{type(ex).__name__}: {ex}'
+    return filename,entry
+
+def _encode_ngrams(ngrams):
+    return base64.b64encode(array('I',ngrams).tobytes()).decode('ascii')
+
+def _decode_ngrams(text):
+    ret = array('I')
+    ret.frombytes(base64.b64decode(text))
+    return ret
+
+class CorpusIndex:
+    """The summaries of a library of MIDI files, with fast queries
+
+    The summaries are kept in one JSON file (the n-gram fingerprints are
+    packed as base64 arrays to keep it small). When loaded, inverted indexes
+    are built for programs, channels, and n-grams, so a query only touches
+    the files that can match.
+    """
+
+    def __init__(self,filename=None):
+        """
+        Args:
+          filename (str): the index file (loaded if it exists)
+        """
+        self.filename = filename
+        self.entries = {} # file name -> summary dict
+        self._postings = None
+        if filename and os.path.exists(filename):
+            self.load(filename)
+
+    def load(self,filename):
+        with open(filename) as f:
+            data = json.load(f)
+        if data.get('version')!=INDEX_VERSION:
+            # An index from another version is rebuilt from scratch
+            self.entries = {}
+        else:
+            self.entries = data['files']
+            for entry in self.entries.values():
+                entry['ngrams'] = _decode_ngrams(entry.get('ngrams',''))
+        self._postings = None
+
+    def save(self,filename=None):
+        filename = filename or self.filename
+        files = {}
+        for name,entry in self.entries.items():
+            entry = dict(entry)
+            entry['ngrams'] = _encode_ngrams(entry.get('ngrams',()))
+            files[name] = entry
+        tmp = filename+'.tmp'
+        with open(tmp,'w') as f:
+            json.dump({'version':INDEX_VERSION,'files':files},f,separators=(',',':'))
+        os.replace(tmp,filename)
+
+    def update(self,paths,workers=None):
+        """Bring the index up to date with the files under the paths
+
+        Files whose size and mtime are unchanged are not read. Files that
+        were touched but have the same content (hash) are not parsed again.
+        Files under the paths that are gone are dropped (files elsewhere
+        in the index are kept as they are).
+
+        Args:
+          paths (list): files, directories, or globs
+          workers (int): number of worker processes (None for one per CPU)
+
+        Returns:
+          dict: files, unchanged, parsed, removed, errors, partial (files parsed
+                with parts skipped), seconds
+
+        Files are kept under their absolute paths (see index_name).
+        """
+        start = time.perf_counter()
+        filenames = sorted(set(index_name(filename) for filename in find_files(paths,MIDI_EXTENSIONS)))
+        jobs = []
+        unchanged = 0
+        for filename in filenames:
+            st = os.stat(filename)
+            old = self.entries.get(filename)
+            if old and old['size']==st.st_size and old['mtime']==st.st_mtime:
+                unchanged += 1
+                continue
+            digest = file_hash(filename)
+            if old and old['hash']==digest:
+                old['mtime'] = st.st_mtime
+                unchanged += 1
+                continue
+            jobs.append((filename,st.st_size,st.st_mtime,digest))
+
+        errors = 0
+        partial = 0
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for filename,entry in pool.map(_index_job,jobs,chunksize=8):
+                    if entry['error']:
+                        errors += 1
+                    elif entry['problems']:
+                        partial += 1
+                    entry['ngrams'] = array('I',entry.get('ngrams',()))
+                    self.entries[filename] = entry
+
+        # Only files the paths cover can be known to be gone: the rest of the
+        # library was not scanned this time
+        removed = [name for name in self.entries if not os.path.exists(name) and _covered(name,paths)]
+        for name in removed:
+            del self.entries[name]
+        self._postings = None
+        return {'files':len(filenames),'unchanged':unchanged,'parsed':len(jobs),
+                'removed':len(removed),'errors':errors,'partial':partial,'seconds':time.perf_counter()-start}
+
+    def _build_postings(self):
+        programs = {} # (channel, program) -> set of file names
+        channels = {} # channel -> set of file names
+        ngrams = {}   # fingerprint -> set of file names
+        for name,entry in self.entries.items():
+            if entry.get('error'):
+                continue
+            for channel,program in entry['programs']:
+                programs.setdefault((channel,program),set()).add(name)
+            for channel in entry['channels']:
+                channels.setdefault(channel,set()).add(name)
+            for fingerprint in entry['ngrams']:
+                ngrams.setdefault(fingerprint,set()).add(name)
+        self._postings = (programs,channels,ngrams)
+
+    def search(self,program=None,channel=None,intervals=None,note_min=None,note_max=None,
+               tempo_min=None,tempo_max=None,duration_min=None,duration_max=None):
+        """Find the files that match every given condition
+
+        Args:
+          program (int): a program used (on the given channel if there is one)
+          channel (int): a channel used (0-15)
+          intervals (list): a run of melodic intervals in semitones (like [2,2,-4]).
+                            At least NGRAM_SIZE long; longer runs match files that
+                            have every part of the run (maybe not in one place).
+          note_min (int): no notes lower than this
+          note_max (int): no notes higher than this
+          tempo_min (float): some tempo (BPM) at least this
+          tempo_max (float): some tempo (BPM) at most this
+          duration_min (float): at least this many seconds long
+          duration_max (float): at most this many seconds long
+
+        Returns:
+          list: the matching file names (sorted)
+        """
+        if self._postings is None:
+            self._build_postings()
+        programs,channels,ngrams = self._postings
+
+        candidates = None
+        def narrow(names):
+            nonlocal candidates
+            candidates = set(names) if candidates is None else candidates & names
+
+        if program is not None:
+            if channel is not None:
+                narrow(programs.get((channel,program),set()))
+            else:
+                narrow(set().union(*(names for (_,p),names in programs.items() if p==program)))
+        elif channel is not None:
+            narrow(channels.get(channel,set()))
+        if intervals is not None:
+            if len(intervals)<NGRAM_SIZE:
+                raise Exception(f'Give at least {NGRAM_SIZE} intervals')
+            # interval_ngrams takes notes: rebuild a melody from the intervals
+            notes = [0]
+            for interval in intervals:
+                notes.append(notes[-1]+interval)
+            for fingerprint in interval_ngrams(notes):
+                narrow(ngrams.get(fingerprint,set()))
+        if candidates is None:
+            candidates = set(name for name,entry in self.entries.items() if not entry.get('error'))
+
+        ret = []
+        for name in candidates:
+            entry = self.entries[name]
+            if note_min is not None and (entry['note_min'] is None or entry['note_min']<note_min):
+                continue
+            if note_max is not None and (entry['note_max'] is None or entry['note_max']>note_max):
+                continue
+            if tempo_min is not None and not any(t>=tempo_min for t in entry['tempos']):
+                continue
+            if tempo_max is not None and not any(t<=tempo_max for t in entry['tempos']):
+                continue
+            if duration_min is not None and entry['duration']<duration_min:
+                continue
+            if duration_max is not None and entry['duration']>duration_max:
+                continue
+            ret.append(name)
+        return sorted(ret)
+
+QUERY_OPTIONS = {
+    '-program': ('program',int),
+    '-channel': ('channel',int),
+    '-intervals': ('intervals',lambda s: [int(v) for v in s.split(',')]),
+    '-noteMin': ('note_min',int),
+    '-noteMax': ('note_max',int),
+    '-tempoMin': ('tempo_min',float),
+    '-tempoMax': ('tempo_max',float),
+    '-durationMin': ('duration_min',float),
+    '-durationMax': ('duration_max',float),
+}
+
+if __name__=='__main__':
+
+    # py -m midi_index INDEX -update [-workers N] PATH ...
+    # py -m midi_index INDEX -query [-program N] [-channel N] [-intervals 2,2,-4] [-noteMin N] [-noteMax N]
+    #                               [-tempoMin BPM] [-tempoMax BPM] [-durationMin S] [-durationMax S]
+    # Channels are numbered 0-15 (as in the disassembly).
+
+    index = CorpusIndex(sys.argv[1])
+    mode = sys.argv[2]
+    args = sys.argv[3:]
+    if mode=='-update':
+        workers = None
+        paths = []
+        while args:
+            arg = args.pop(0)
+            if arg=='-workers':
+                workers = int(args.pop(0))
+            else:
+                paths.append(arg)
+        result = index.update(paths,workers)
+        index.save()
+        print("Files=%d Unchanged=%d Parsed=%d Removed=%d Errors=%d Partial=%d Seconds=%.2f" % (
+            result['files'],result['unchanged'],result['parsed'],result['removed'],result['errors'],
+            result['partial'],result['seconds']))
+    elif mode=='-query':
+        query = {}
+        while args:
+            arg = args.pop(0)
+            if arg not in QUERY_OPTIONS:
+                raise Exception(f'Unknown option "{arg}"')
+            name,convert = QUERY_OPTIONS[arg]
+            query[name] = convert(args.pop(0))
+        start = time.perf_counter()
+        found = index.search(**query)
+        seconds = time.perf_counter() - start
+        for name in found:
+            print(name)
+        print("Matches=%d Seconds=%.4f" % (len(found),seconds),file=sys.stderr)
+    else:
+        raise Exception(f'Unknown mode "{mode}"')
@@ -0,0 +1,272 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import socket
+import sys
+import time
+
+from midi_file import MIDIFile
+from midi_events import MetaEvent, SystemExclusiveEvent
+from midi_events import MIDIChannelNoteEvent
+from midi_events import MIDIChannelProgramChangeEvent
+from midi_events import MIDIChannelControlChangeEvent
+from midi_events import MIDIChannelPolyphonicKeyPressureEvent
+from midi_events import MIDIChannelPressureEvent
+from midi_events import MIDIChannelPitchBendEvent
+from midi_events import MIDIChannelRunningStatusEvent
+from midi_tempo import TempoMap, tempo_events, track_length
+from midi_track_merge import merge_tracks
+
+"""Play MIDI in real time to an output sink"""
+
+def message_bytes(event):
+    """Return the raw MIDI message of an event (what goes over the wire)
+
+    Args:
+      event: any of the events from midi_events
+
+    Returns:
+      bytes: the message, or None for events that are not sent (meta events)
+    """
+    if isinstance(event,MIDIChannelRunningStatusEvent):
+        event = event.get_expanded_event()
+    if isinstance(event,MIDIChannelNoteEvent):
+        return bytes(((0x90 if event.note_on else 0x80) | event.channel,event.note,event.velocity))
+    if isinstance(event,MIDIChannelControlChangeEvent):
+        return bytes((0xB0 | event.channel,event.controller,event.value))
+    if isinstance(event,MIDIChannelProgramChangeEvent):
+        return bytes((0xC0 | event.channel,event.value))
+    if isinstance(event,MIDIChannelPolyphonicKeyPressureEvent):
+        return bytes((0xA0 | event.channel,event.note,event.value))
+    if isinstance(event,MIDIChannelPressureEvent):
+        return bytes((0xD0 | event.channel,event.value))
+    if isinstance(event,MIDIChannelPitchBendEvent):
+        return bytes((0xE0 | event.channel,)+event.data_bytes())
+    if isinstance(event,SystemExclusiveEvent):
+        if event.data[0]==0xF7:
+            # Escaped bytes go out as they are (the F7 is not part of them)
+            return event.data[1:]
+        return event.data
+    if isinstance(event,MetaEvent):
+        return None
+    raise NotImplementedError(event)
+
+def schedule(music,divis=None):
+    """Work out when every message is sent
+
+    Args:
+      music: a MIDIFile, or a single track (like one from merge_tracks)
+      divis (int): the division (ticks per quarter) for a single track
+
+    Returns:
+      list: (seconds from the start, message bytes) in time order
+    """
+    if isinstance(music,MIDIFile):
+        divis = music.divis
+        track = merge_tracks(music.tracks)
+    else:
+        if divis is None:
+            raise Exception('A single track needs the division (ticks per quarter note)')
+        track = music
+    tempo_map = TempoMap(divis,tempo_events(track),track_length(track))
+
+    ret = []
+    tick = 0
+    for event in track:
+        tick += event.delta
+        message = message_bytes(event)
+        if message is not None:
+            ret.append((tempo_map.tick_to_seconds(tick),message))
+    return ret
+
+# -------------------------------------------------------------------------
+# Sinks: anything callable with the message bytes
+
+class FileSink:
+    """Write the messages to a binary file or pipe (like a raw MIDI device)"""
+
+    def __init__(self,f):
+        self.f = f
+
+    def __call__(self,message):
+        self.f.write(message)
+        self.f.flush()
+
+class UDPSink:
+    """Send each message as one UDP datagram"""
+
+    def __init__(self,host,port):
+        self.address = (host,port)
+        self.sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+
+    def __call__(self,message):
+        self.sock.sendto(message,self.address)
+
+    def close(self):
+        self.sock.close()
+
+class CaptureSink:
+    """Keep every message with the clock time it was sent (for tests)"""
+
+    def __init__(self,clock=time.monotonic):
+        self.clock = clock
+        self.messages = [] # (clock time, message bytes)
+
+    def __call__(self,message):
+        self.messages.append((self.clock(),message))
+
+class FakeClock:
+    """A clock that only moves when something sleeps (for tests)
+
+    Pass clock.now as the player's clock and clock.sleep (or
+    clock.async_sleep) as its sleep.
+    """
+
+    def __init__(self,start=0.0):
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def sleep(self,seconds):
+        if seconds>0:
+            self.time += seconds
+
+    async def async_sleep(self,seconds):
+        self.sleep(seconds)
+
+# -------------------------------------------------------------------------
+# Timing
+
+class JitterStats:
+    """How late each message went out (compared to its deadline)"""
+
+    def __init__(self):
+        self.lateness = [] # seconds late for each message
+
+    def add(self,seconds_late):
+        self.lateness.append(seconds_late)
+
+    def summary(self):
+        """
+        Returns:
+          dict: count, mean, p50, p99, max (seconds late)
+        """
+        if not self.lateness:
+            return {'count':0,'mean':0.0,'p50':0.0,'p99':0.0,'max':0.0}
+        ordered = sorted(self.lateness)
+        count = len(ordered)
+        return {
+            'count': count,
+            'mean': sum(ordered)/count,
+            'p50': ordered[count//2],
+            'p99': ordered[min(count-1,int(count*0.99))],
+            'max': ordered[-1],
+        }
+
+    def __str__(self):
+        s = self.summary()
+        return "Messages=%d Late(ms) mean=%.3f p50=%.3f p99=%.3f max=%.3f" % (
+            s['count'],s['mean']*1000,s['p50']*1000,s['p99']*1000,s['max']*1000)
+
+class Player:
+    """Send MIDI messages to a sink on time
+
+    Every message has an absolute deadline (the start time plus its time in
+    the music). The player sleeps until each deadline rather than for the
+    gap since the last message, so sleep overshoot never adds up over a long
+    song. Messages that are already due go out without sleeping.
+    """
+
+    def __init__(self,sink,clock=time.monotonic,sleep=time.sleep,async_sleep=asyncio.sleep):
+        """
+        Args:
+          sink: called with the bytes of each message
+          clock: returns the current time in seconds (must never go backwards)
+          sleep: blocks for a number of seconds
+          async_sleep: awaitable sleep for play_async
+        """
+        self.sink = sink
+        self.clock = clock
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+
+    def play(self,music,divis=None):
+        """Play music, blocking until it is done
+
+        Args:
+          music: a MIDIFile, or a single track (like one from merge_tracks)
+          divis (int): the division for a single track
+
+        Returns:
+          JitterStats: how late the messages were
+        """
+        stats = JitterStats()
+        start = self.clock()
+        for seconds,message in schedule(music,divis):
+            deadline = start + seconds
+            wait = deadline - self.clock()
+            if wait>0:
+                self.sleep(wait)
+            self.sink(message)
+            stats.add(self.clock()-deadline)
+        return stats
+
+    async def play_async(self,music,divis=None):
+        """Play music from an asyncio task (see play)"""
+        stats = JitterStats()
+        start = self.clock()
+        for seconds,message in schedule(music,divis):
+            deadline = start + seconds
+            wait = deadline - self.clock()
+            if wait>0:
+                await self.async_sleep(wait)
+            self.sink(message)
+            stats.add(self.clock()-deadline)
+        return stats
+
+if __name__=='__main__':
+
+    # py -m midi_player song.mid [-udp HOST:PORT] [-out FILE]
+    # With no sink option the raw MIDI bytes go to stdout.
+
+    args = sys.argv[2:]
+    sink = None
+    while args:
+        arg = args.pop(0)
+        if arg=='-udp':
+            host,port = args.pop(0).rsplit(':',1)
+            sink = UDPSink(host,int(port))
+        elif arg=='-out':
+            sink = FileSink(open(args.pop(0),'wb'))
+        else:
+            raise Exception(f'Unknown option "{arg}"')
+    if sink is None:
+        sink = FileSink(sys.stdout.buffer)
+
+    midi = MIDIFile()
+    midi.parse_file(sys.argv[1])
+    stats = Player(sink).play(midi)
+    print(stats,file=sys.stderr)
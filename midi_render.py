@@ -0,0 +1,220 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import sys
+import time
+import wave
+
+import numpy
+
+from midi_file import MIDIFile
+from midi_events import MIDIChannelNoteEvent
+from midi_events import MIDIChannelProgramChangeEvent
+from midi_events import MIDIChannelRunningStatusEvent
+from midi_tempo import TempoMap
+from midi_track_merge import merge_tracks
+
+"""Render a MIDIFile to a WAV file with simple oscillators (needs NumPy)"""
+
+DRUM_CHANNEL = 9
+
+# The sound of each General MIDI instrument family (program//8):
+# (waveform, how fast the note fades while held in 1/seconds)
+FAMILY_SOUNDS = (
+    ('triangle',1.5), # Piano
+    ('sine',3.0),     # Chromatic percussion
+    ('square',0.0),   # Organ
+    ('sawtooth',1.0), # Guitar
+    ('triangle',0.5), # Bass
+    ('sawtooth',0.0), # Strings
+    ('sawtooth',0.0), # Ensemble
+    ('square',0.0),   # Brass
+    ('square',0.0),   # Reed
+    ('sine',0.0),     # Pipe
+    ('square',0.0),   # Synth lead
+    ('sawtooth',0.0), # Synth pad
+    ('sine',0.5),     # Synth effects
+    ('sawtooth',1.0), # Ethnic
+    ('noise',6.0),    # Percussive
+    ('noise',2.0),    # Sound effects
+)
+
+ATTACK_SECONDS = 0.005
+RELEASE_SECONDS = 0.05
+DRUM_SECONDS = 0.15 # Drum hits ring this long whatever the note length
+VOICE_GAIN = 0.15
+
+def _waveform(name,phase,rng):
+    # phase is in cycles (1.0 is one full period)
+    if name=='sine':
+        return numpy.sin(2*numpy.pi*phase)
+    if name=='square':
+        return numpy.where((phase % 1.0)<0.5,1.0,-1.0)
+    if name=='sawtooth':
+        return 2.0*(phase % 1.0)-1.0
+    if name=='triangle':
+        return 4.0*numpy.abs((phase % 1.0)-0.5)-1.0
+    return rng.uniform(-1.0,1.0,len(phase))
+
+def note_list(midi):
+    """Pair up the NoteOn and NoteOff events of a file
+
+    Args:
+      midi (MIDIFile): the music
+
+    Returns:
+      list: (start seconds, end seconds, channel, note, velocity, program) sorted by start
+    """
+    tempo_map = TempoMap.from_midi(midi)
+    programs = [0]*16
+    sounding = {} # (channel, note) -> list of (start tick, velocity, program)
+    ret = []
+    tick = 0
+    for event in merge_tracks(midi.tracks):
+        tick += event.delta
+        if isinstance(event,MIDIChannelRunningStatusEvent):
+            event = event.get_expanded_event()
+        if isinstance(event,MIDIChannelProgramChangeEvent):
+            programs[event.channel] = event.value
+        elif isinstance(event,MIDIChannelNoteEvent):
+            key = (event.channel,event.note)
+            if event.note_on and event.velocity:
+                sounding.setdefault(key,[]).append((tick,event.velocity,programs[event.channel]))
+            elif sounding.get(key):
+                start,velocity,program = sounding[key].pop(0)
+                ret.append((tempo_map.tick_to_seconds(start),tempo_map.tick_to_seconds(tick),
+                            event.channel,event.note,velocity,program))
+    # Notes never released end with the music
+    for (channel,note),starts in sounding.items():
+        for start,velocity,program in starts:
+            ret.append((tempo_map.tick_to_seconds(start),tempo_map.duration(),channel,note,velocity,program))
+    ret.sort()
+    return ret
+
+class _Voice:
+    """One note being synthesized (positions are in samples)"""
+
+    __slots__ = ('start','end','stop','frequency','gain','waveform','decay','rng')
+
+    def __init__(self,note,sample_rate):
+        start,end,channel,number,velocity,program = note
+        self.start = int(start*sample_rate)
+        if channel==DRUM_CHANNEL:
+            self.waveform,self.decay = 'noise',1.0/DRUM_SECONDS
+            end = start+DRUM_SECONDS
+        else:
+            self.waveform,self.decay = FAMILY_SOUNDS[program//8]
+        self.end = max(int(end*sample_rate),self.start+1)
+        self.stop = self.end + int(RELEASE_SECONDS*sample_rate) # Silent from here on
+        self.frequency = 440.0 * 2.0**((number-69)/12.0)
+        self.gain = VOICE_GAIN * velocity/127.0
+        self.rng = numpy.random.default_rng(number)
+
+    def render(self,block,block_start,sample_rate):
+        """Add this voice's samples to the block (which starts at sample block_start)"""
+        first = max(self.start,block_start)
+        last = min(self.stop,block_start+len(block))
+        if first>=last:
+            return
+        t = numpy.arange(first-self.start,last-self.start,dtype=numpy.float64) / sample_rate
+        samples = _waveform(self.waveform,self.frequency*t,self.rng)
+        envelope = numpy.minimum(t/ATTACK_SECONDS,1.0)
+        if self.decay:
+            envelope *= numpy.exp(-self.decay*t)
+        held = (self.end-self.start)/sample_rate
+        envelope *= numpy.clip(1.0-(t-held)/RELEASE_SECONDS,0.0,1.0)
+        block[first-block_start:last-block_start] += self.gain*samples*envelope
+
+def render_blocks(midi,sample_rate=44100,block_size=4096):
+    """Synthesize the music a block at a time
+
+    Only the voices sounding in a block are computed for it, and each voice
+    is computed for the whole block at once. Memory use depends on the block
+    size and the number of notes, not on the length of the music.
+
+    Args:
+      midi (MIDIFile): the music
+      sample_rate (int): samples per second
+      block_size (int): samples per block
+
+    Yields:
+      numpy.ndarray: int16 samples (mono), block_size of them except the last block
+    """
+    notes = note_list(midi)
+    voices = [_Voice(note,sample_rate) for note in notes]
+    total = max((voice.stop for voice in voices),default=0)
+    active = []
+    next_voice = 0
+    for block_start in range(0,total,block_size):
+        block_end = min(block_start+block_size,total)
+        block = numpy.zeros(block_end-block_start,dtype=numpy.float64)
+        while next_voice<len(voices) and voices[next_voice].start<block_end:
+            active.append(voices[next_voice])
+            next_voice += 1
+        for voice in active:
+            voice.render(block,block_start,sample_rate)
+        active = [voice for voice in active if voice.stop>block_end]
+        numpy.clip(block,-1.0,1.0,out=block)
+        yield (block*32767).astype('<i2')
+
+def render_wav(midi,filename,sample_rate=44100,block_size=4096):
+    """Render the music to a mono 16-bit WAV file
+
+    Args:
+      midi (MIDIFile): the music
+      filename (str): the WAV file to write
+      sample_rate (int): samples per second
+      block_size (int): samples per block
+
+    Returns:
+      float: the length of the audio in seconds
+    """
+    samples = 0
+    with wave.open(filename,'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        for block in render_blocks(midi,sample_rate,block_size):
+            f.writeframesraw(block.tobytes())
+            samples += len(block)
+    return samples/sample_rate
+
+if __name__=='__main__':
+
+    # py -m midi_render song.mid song.wav [-rate N] [-block N]
+
+    options = {'-rate':'44100','-block':'4096'}
+    args = sys.argv[3:]
+    while args:
+        arg = args.pop(0)
+        if arg not in options:
+            raise Exception(f'Unknown option "{arg}"')
+        options[arg] = args.pop(0)
+
+    midi = MIDIFile()
+    midi.parse_file(sys.argv[1])
+    start = time.perf_counter()
+    seconds = render_wav(midi,sys.argv[2],int(options['-rate']),int(options['-block']))
+    elapsed = time.perf_counter() - start
+    print("Audio=%.1fs Render=%.2fs Speed=%.0fx real time" % (seconds,elapsed,seconds/elapsed if elapsed else 0.0))
@@ -0,0 +1,261 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import hashlib
+import io
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import music_parser
+from track_cache import TrackCache
+
+"""Compile music text to MIDI over HTTP (asyncio front end, worker processes behind)
+
+POST the music text to /render (add ?runningStatus=1 to compress). The reply
+is the MIDI file (audio/midi) or, if the music has an error, a 400 with the
+message. GET /stats gives the request counts.
+"""
+
+# Each worker process keeps its own in-memory track cache, so a track sent
+# again (with or without other changes) is not compiled again.
+_worker_cache = None
+
+def render_music(text,running_status=False):
+    """Compile music text to the bytes of a MIDI file (runs in a worker process)
+
+    Args:
+      text (str): the music (see music_parser)
+      running_status (bool): compress the tracks with running status
+
+    Returns:
+      bytes: the MIDI file
+    """
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = TrackCache()
+    f = io.BytesIO()
+    music_parser.compile_music_to(text.split('\n'),f,'<request>',_worker_cache,running_status)
+    return f.getvalue()
+
+class RenderService:
+    """Accept render requests and hand them to a pool of worker processes
+
+    Identical requests that arrive while the first is still compiling wait
+    for the same result rather than compiling again.
+    """
+
+    def __init__(self,workers=None,executor=None):
+        """
+        Args:
+          workers (int): number of worker processes (None for one per CPU)
+          executor: use this executor instead of making a process pool
+        """
+        self.executor = executor or ProcessPoolExecutor(max_workers=workers)
+        self.pending = {} # request key -> future of the MIDI bytes
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def render(self,text,running_status=False):
+        """Compile music text to MIDI bytes
+
+        Args:
+          text (str): the music
+          running_status (bool): compress the tracks with running status
+
+        Returns:
+          bytes: the MIDI file
+        """
+        self.requests += 1
+        key = hashlib.sha256(f'{running_status}\n{text}'.encode()).digest()
+        future = self.pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor,render_music,text,running_status)
+        self.pending[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self.pending.pop(key,None)
+            else:
+                # This caller went away; the others still get the result
+                future.add_done_callback(lambda _: self.pending.pop(key,None))
+
+    def stats(self):
+        return {'requests':self.requests,'coalesced':self.coalesced,'errors':self.errors,'pending':len(self.pending)}
+
+    # ---------------------------------------------------------------------
+    # HTTP
+
+    async def handle_connection(self,reader,writer):
+        """Serve HTTP/1.1 requests on one connection (kept alive until the client closes it)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method,target,_ = request_line.decode('latin-1').split(' ',2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n',b'\n',b''):
+                        break
+                    name,_,value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length',0)))
+                status,content_type,data = await self.handle_request(method,target,body)
+                writer.write((f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                              f'Content-Length: {len(data)}\r\n\r\n').encode()+data)
+                await writer.drain()
+                if headers.get('connection','').lower()=='close':
+                    break
+        except (ConnectionError,asyncio.IncompleteReadError,ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self,method,target,body):
+        """
+        Returns:
+          tuple: (status line, content type, body bytes)
+        """
+        path,_,query = target.partition('?')
+        if method=='POST' and path=='/render':
+            running_status = 'runningStatus=1' in query.split('&')
+            try:
+                data = await self.render(body.decode(),running_status)
+            except Exception as ex:
+                self.errors += 1
+                return '400 Bad Request','text/plain',f'{type(ex).__name__}: {ex}'.encode()
+            return '200 OK','audio/midi',data
+        if method=='GET' and path=='/stats':
+            return '200 OK','text/plain',repr(self.stats()).encode()
+        return '404 Not Found','text/plain',b'Not found'
+
+    async def serve(self,host='127.0.0.1',port=8000,unix_path=None):
+        """Serve forever on a TCP port or a unix socket"""
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection,unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection,host,port)
+        async with server:
+            await server.serve_forever()
+
+# -------------------------------------------------------------------------
+# Test client
+
+async def _client_connection(host,port,text,count,latencies,errors):
+    reader,writer = await asyncio.open_connection(host,port)
+    body = text.encode()
+    request = (f'POST /render HTTP/1.1\r\nHost: {host}\r\nContent-Type: text/plain\r\n'
+               f'Content-Length: {len(body)}\r\n\r\n').encode()+body
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n',b''):
+                    break
+                name,_,value = line.decode('latin-1').partition(':')
+                if name.strip().lower()=='content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter()-start)
+            if b' 200 ' not in status:
+                errors.append(status)
+    finally:
+        writer.close()
+
+async def run_client(host,port,text,requests=100,concurrency=8):
+    """Send the same music many times and measure the service
+
+    Args:
+      host (str): the service host
+      port (int): the service port
+      text (str): the music to send
+      requests (int): the total number of requests
+      concurrency (int): the number of connections sending at once
+
+    Returns:
+      dict: requests, errors, seconds, requests_per_sec, p50, p99 (latency in seconds)
+    """
+    latencies = []
+    errors = []
+    per_connection = [requests//concurrency + (1 if n<requests%concurrency else 0) for n in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(_client_connection(host,port,text,count,latencies,errors)
+                           for count in per_connection if count))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': seconds,
+        'requests_per_sec': len(latencies)/seconds if seconds else 0.0,
+        'p50': latencies[len(latencies)//2] if latencies else 0.0,
+        'p99': latencies[min(len(latencies)-1,int(len(latencies)*0.99))] if latencies else 0.0,
+    }
+
+if __name__=='__main__':
+
+    # py -m midi_service -serve [-host H] [-port P] [-unix PATH] [-workers N]
+    # py -m midi_service -client song.txt [-host H] [-port P] [-requests N] [-concurrency N]
+
+    options = {'-host':'127.0.0.1','-port':'8000','-unix':None,'-workers':None,
+               '-requests':'100','-concurrency':'8'}
+    mode = sys.argv[1]
+    args = sys.argv[2:]
+    song = None
+    if mode=='-client':
+        song = args.pop(0)
+    while args:
+        arg = args.pop(0)
+        if arg not in options:
+            raise Exception(f'Unknown option "{arg}"')
+        options[arg] = args.pop(0)
+
+    if mode=='-serve':
+        workers = int(options['-workers']) if options['-workers'] else None
+        service = RenderService(workers)
+        print(f"Serving on {options['-unix'] or options['-host']+':'+options['-port']}",file=sys.stderr)
+        asyncio.run(service.serve(options['-host'],int(options['-port']),options['-unix']))
+    elif mode=='-client':
+        with open(song) as f:
+            text = f.read()
+        result = asyncio.run(run_client(options['-host'],int(options['-port']),text,
+                                        int(options['-requests']),int(options['-concurrency'])))
+        print("Requests=%d Errors=%d Seconds=%.2f Requests/sec=%.1f p50(ms)=%.2f p99(ms)=%.2f" % (
+            result['requests'],result['errors'],result['seconds'],result['requests_per_sec'],
+            result['p50']*1000,result['p99']*1000))
+    else:
+        raise Exception(f'Unknown mode "{mode}"')
@@ -0,0 +1,163 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+"""Timing and counting hooks for the toolchain
+
+The tools report their phases here: "read", "header", "decode_track",
+"encode_track", "write", "assemble", "disassemble", "compile_track".
+Nothing is measured unless a hook is attached.
+
+A hook is a function that takes (phase, seconds, info). The info dict has
+whatever the phase knows, like "bytes" (the number of bytes read or
+written) or "events" (the events decoded or encoded). For example, to send
+the timings to a metrics backend:
+
+    def send(phase,seconds,info):
+        metrics.timing('midi.'+phase,seconds)
+
+    midi_stats.add_hook(send)
+"""
+
+_hooks = []
+
+def add_hook(hook):
+    """Attach a hook (called at the end of every phase)"""
+    _hooks.append(hook)
+
+def remove_hook(hook):
+    """Detach a hook"""
+    _hooks.remove(hook)
+
+def enabled():
+    """True if any hook is attached"""
+    return bool(_hooks)
+
+@contextmanager
+def phase(name,**info):
+    """Time a phase of the work and report it to the hooks
+
+    The body can add to the info (for instance the number of bytes once they
+    are known) through the dict the context manager gives.
+
+    Args:
+      name (str): the phase
+      info: anything else the hooks should know
+    """
+    if not _hooks:
+        yield info
+        return
+    start = time.perf_counter()
+    yield info
+    seconds = time.perf_counter() - start
+    for hook in list(_hooks):
+        hook(name,seconds,info)
+
+class Stats:
+    """A hook that totals the time, bytes, and events of each phase"""
+
+    def __init__(self):
+        self.phases = {} # name -> [count, seconds, bytes]
+        self.event_types = {} # (phase, event class name) -> count
+
+    def __call__(self,name,seconds,info):
+        entry = self.phases.setdefault(name,[0,0.0,0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += info.get('bytes',0)
+        for event in info.get('events',()):
+            key = (name,type(event).__name__)
+            self.event_types[key] = self.event_types.get(key,0) + 1
+
+    def report(self,out=sys.stderr):
+        """Print the totals"""
+        print("%-16s %8s %10s %12s" % ('phase','count','seconds','bytes'),file=out)
+        for name,(count,seconds,num_bytes) in self.phases.items():
+            print("%-16s %8d %10.4f %12d" % (name,count,seconds,num_bytes),file=out)
+        for (name,type_name),count in sorted(self.event_types.items()):
+            print("%-16s %-40s %8d" % (name,type_name,count),file=out)
+
+def extract_options(argv):
+    """Take the instrumentation options out of a command line
+
+    -stats               print the per-phase totals to stderr at the end
+    -profile FILE        run under cProfile and dump the stats to FILE
+    -tracemalloc FILE    trace allocations and write the top sources to FILE
+
+    Args:
+      argv (list): the command line
+
+    Returns:
+      tuple: (the command line without the options, dict of the options)
+    """
+    ret = []
+    options = {'stats':False,'profile':None,'tracemalloc':None}
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg=='-stats':
+            options['stats'] = True
+        elif arg=='-profile':
+            options['profile'] = args.pop(0)
+        elif arg=='-tracemalloc':
+            options['tracemalloc'] = args.pop(0)
+        else:
+            ret.append(arg)
+    return ret,options
+
+@contextmanager
+def instrumented(options,out=sys.stderr):
+    """Run the body with the instrumentation asked for (see extract_options)"""
+    stats = None
+    profiler = None
+    if options['stats']:
+        stats = Stats()
+        add_hook(stats)
+    if options['tracemalloc']:
+        import tracemalloc
+        tracemalloc.start()
+    if options['profile']:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield stats
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(options['profile'])
+        if options['tracemalloc']:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with open(options['tracemalloc'],'w') as f:
+                f.write(f'Peak traced memory: {peak} bytes\n')
+                for stat in snapshot.statistics('lineno')[:50]:
+                    f.write(str(stat)+'\n')
+        if stats:
+            remove_hook(stats)
+            stats.report(out)
@@ -0,0 +1,196 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from midi_events import MetaEvent
+from midi_event_table import EventTable
+
+"""Convert between MIDI ticks and seconds using a file's tempo changes"""
+
+# Microseconds per quarter note when a file has no tempo event (120 BPM)
+DEFAULT_TEMPO = 500_000
+
+TEMPO_META_TYPE = 0x51
+
+def tempo_events(track):
+    """Find the tempo changes in a track
+
+    Params:
+      track (list): The MIDI track (a list of events or an EventTable)
+
+    Yields:
+      tuple: (absolute_tick, microseconds_per_quarter)
+    """
+    if isinstance(track,EventTable):
+        # Go through the columns rather than making every event
+        tick = 0
+        for i,delta in enumerate(track.delta):
+            tick += delta
+            if track.status[i]==EventTable.STATUS_META and track.data1[i]==TEMPO_META_TYPE and track.length[i]==3:
+                offset = track.offset[i]
+                yield tick,int.from_bytes(track.blob[offset:offset+3],'big')
+        return
+    tick = 0
+    for event in track:
+        tick += event.delta
+        if isinstance(event,MetaEvent) and event.meta_type==TEMPO_META_TYPE and len(event.meta_data)==3:
+            yield tick,int.from_bytes(event.meta_data,'big')
+
+def absolute_ticks(track):
+    """Make the absolute-time index of a track
+
+    Params:
+      track (list): The MIDI track (a list of events or an EventTable)
+
+    Returns:
+      array: the absolute tick of each event (sorted, so it can be bisected)
+    """
+    if isinstance(track,EventTable):
+        return array('Q',accumulate(track.delta))
+    return array('Q',accumulate(event.delta for event in track))
+
+def track_length(track):
+    """Return the absolute tick of the last event in a track"""
+    if isinstance(track,EventTable):
+        return sum(track.delta)
+    return sum(event.delta for event in track)
+
+class TempoMap:
+    """Tick and seconds conversion for one MIDI file
+
+    The map is built once from the file's division and every tempo (0x51)
+    meta event in every track. Each tempo change is a segment: the tick it
+    starts on, the number of seconds before it, and the seconds per tick
+    within it. The segments are kept in sorted arrays, so a conversion is a
+    binary search and one multiply.
+
+    If two tempo changes are on the same tick, the one in the later track
+    wins (the same order merge_tracks plays them in).
+
+    Files with SMPTE division (the top bit of divis set) count ticks in
+    frames rather than beats. Tempo events do not change their timing.
+    """
+
+    def __init__(self,divis,tempos=(),end_tick=0):
+        """
+        Args:
+          divis (int): the division from the MIDI header
+          tempos (iterable): (absolute_tick, microseconds_per_quarter) for each tempo change
+          end_tick (int): the tick the music ends on (for duration)
+        """
+        self.divis = divis
+        self.ticks = array('Q',[0])
+        self.seconds = array('d',[0.0])
+        self.tempos = array('L',[DEFAULT_TEMPO])
+
+        if divis & 0x8000:
+            # SMPTE: the high byte is minus the frames per second, the low byte is ticks per frame
+            frames_per_second = 256 - (divis>>8)
+            if frames_per_second==29:
+                frames_per_second = 29.97
+            ticks_per_second = frames_per_second * (divis & 0xFF)
+            self.seconds_per_tick = array('d',[1.0/ticks_per_second])
+        else:
+            self.seconds_per_tick = array('d',[DEFAULT_TEMPO/1_000_000/divis])
+            for tick,tempo in sorted(tempos,key=lambda t: t[0]):
+                seconds = self.seconds[-1] + (tick-self.ticks[-1])*self.seconds_per_tick[-1]
+                if tick==self.ticks[-1]:
+                    # A change on the same tick replaces the segment
+                    self.tempos[-1] = tempo
+                    self.seconds_per_tick[-1] = tempo/1_000_000/divis
+                    continue
+                self.ticks.append(tick)
+                self.seconds.append(seconds)
+                self.tempos.append(tempo)
+                self.seconds_per_tick.append(tempo/1_000_000/divis)
+
+        self.end_tick = max(end_tick,self.ticks[-1])
+
+    @staticmethod
+    def from_midi(midi):
+        """Build the map for a parsed MIDIFile
+
+        Args:
+          midi (MIDIFile): the file (tracks may be lists of events or EventTables)
+
+        Returns:
+          TempoMap: the map
+        """
+        tempos = []
+        end_tick = 0
+        for track in midi.tracks:
+            tempos.extend(tempo_events(track))
+            end_tick = max(end_tick,track_length(track))
+        return TempoMap(midi.divis,tempos,end_tick)
+
+    def _segment_for_tick(self,tick):
+        return max(bisect_right(self.ticks,tick)-1,0)
+
+    def _segment_for_seconds(self,seconds):
+        return max(bisect_right(self.seconds,seconds)-1,0)
+
+    def tick_to_seconds(self,tick):
+        """Return the time of a tick
+
+        Args:
+          tick (int): the absolute tick
+
+        Returns:
+          float: seconds from the start of the music
+        """
+        i = self._segment_for_tick(tick)
+        return self.seconds[i] + (tick-self.ticks[i])*self.seconds_per_tick[i]
+
+    def seconds_to_tick(self,seconds):
+        """Return the tick at a time
+
+        Args:
+          seconds (float): the time from the start of the music
+
+        Returns:
+          float: the absolute tick (round or truncate as needed)
+        """
+        i = self._segment_for_seconds(seconds)
+        return self.ticks[i] + (seconds-self.seconds[i])/self.seconds_per_tick[i]
+
+    def tempo_at(self,tick):
+        """Return the tempo in effect at a tick
+
+        Args:
+          tick (int): the absolute tick
+
+        Returns:
+          int: microseconds per quarter note
+        """
+        return self.tempos[self._segment_for_tick(tick)]
+
+    def duration(self):
+        """Return the length of the music in seconds (to the last event of the longest track)"""
+        return self.tick_to_seconds(self.end_tick)
+
+    def __len__(self):
+        return len(self.ticks)
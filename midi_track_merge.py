@@ -22,8 +22,25 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import heapq
+
 from midi_file import MIDIFile
-from midi_events import ContinuationEvent
+from midi_events import MIDIChannelRunningStatusEvent
+
+def _absolute_events(track_number,track):
+    """Walk a track's events with their absolute tick times
+
+    Params:
+      track_number (int): The index of the track (used to break ties)
+      track (list): The MIDI track
+
+    Yields:
+      tuple: (absolute_tick, track_number, event_number, event)
+    """
+    tick = 0
+    for event_number,event in enumerate(track):
+        tick += event.delta
+        yield (tick,track_number,event_number,event)
 
 def merge_tracks(tracks):
     """Merge multiple midi tracks into a single track
@@ -31,6 +48,12 @@ def merge_tracks(tracks):
     MIDI files usually contain multiple tracks that are to be played at the
     same time. This function pulls all the events from multiple tracks into 
     a single track with translated time deltas.
+
+    Each track is converted to absolute tick times and the tracks are
+    combined with a k-way heap merge. Events at the same tick keep their
+    order: lower-numbered tracks first, then the order within the track.
+    Running status events are expanded into full events since the event
+    before them in the merged track may come from a different track.
     
     Params:
       tracks (list): The separate MIDI tracks
@@ -38,37 +61,14 @@ def merge_tracks(tracks):
     Returns:
       track: The single, combined MIDI track      
     """       
-    tick_tracking = []
-    for track in tracks:
-        tick_tracking.append([track[0].delta,0,track])
-        
-    master_delta = 0
+    walkers = [_absolute_events(n,track) for n,track in enumerate(tracks)]
+
     ret = []
-    
-    while len(tick_tracking)>0:    # Tracks drop out as they complete
-        event_added=False
-        for tt in tick_tracking:     # Process track one at a time
-            if tt[0]>0:  
-                # Not time for this track's event. Just decrement the time.       
-                tt[0] = tt[0]-1     
-            else:
-                while tt[0]==0: # Might be several events at this time
-                    # Add this event to the master timeline
-                    ne = tt[2][tt[1]].make_copy(master_delta)
-                    if isinstance(ne,ContinuationEvent):
-                        ne = ne.get_expanded_event()
-                    ret.append(ne)
-                    # Move the master delta to 0 (an event just happened)
-                    master_delta = 0         
-                    event_added=True           
-                    # Move to the next event in the track, remove if none, add if delta is 0
-                    tt[1] = tt[1] + 1 # Next event
-                    if tt[1]>=len(tt[2]):
-                        # Done with this track ... remove it and break out of loop
-                        tick_tracking.remove(tt)
-                        break
-                    tt[0] = tt[2][tt[1]].delta 
-        if not event_added:
-            master_delta = master_delta + 1 # Nothing happened this tick
+    last_tick = 0
+    for tick,_,_,event in heapq.merge(*walkers):
+        if isinstance(event,MIDIChannelRunningStatusEvent):
+            event = event.get_expanded_event()
+        ret.append(event.with_delta(tick-last_tick))
+        last_tick = tick
     
     return ret
@@ -1,6 +1,11 @@
+import io
+import os
 import string
 import sys
 import logging
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 from midi_events import MetaEvent, SystemExclusiveEvent
 from midi_events import MIDIChannelNoteEvent
@@ -12,30 +17,115 @@ from midi_events import MIDIChannelRunningStatusEvent
 #import midi_track_merge
 import midi_diss
 from midi_file import MIDIFile
+from track_cache import TrackCache
+import midi_stats
 
 LOGGER = logging.getLogger(__name__)
 
-def pull_tracks(lines):
-    """Pull the music tracks from the list of lines.
+# One note token: ACCENT LENGTH DOTS PLET TIE NOTE ACCIDENTAL OCTAVE [:NOTE ACCIDENTAL OCTAVE]...
+NOTE_PATTERN = re.compile(r'([>.\-^]?)([0-9]*)(\.*)([td]?)(~?)([A-GR])([#bn]?)([0-9]*)([+\-]*)((?::[A-GR][#bn]?[0-9]*[+\-]*)*)')
 
-    Tracks are of the form "Track X:", where X is the track name. All the
-    music that follows the track-header (up to the next track) is
-    part of the track.
+# One parallel note (after the first): NOTE ACCIDENTAL OCTAVE
+PITCH_PATTERN = re.compile(r':([A-GR])([#bn]?)([0-9]*)([+\-]*)')
+
+# The syntax of a note token. Each pitch is (note_name, note_accidental,
+# absolute_octave or None, octave_offset). The length fields are None when
+# the note does not give a length.
+ParsedNote = namedtuple('ParsedNote','accent len dots plet tie pitches')
+
+# Tokens repeat a lot in a score. Remember the ones we have seen.
+_PARSED_NOTES = {}
+_MAX_PARSED_NOTES = 0x10000
+
+def _make_pitch(name,accidental,octave,moves):
+    return (name,accidental or None,int(octave) if octave else None,moves.count('+')-moves.count('-'))
+
+def tokenize_note(text):
+    """Parse the syntax of one note token in a single regular expression match
+
+    Args:
+      text (str): the note token (like ">4.d~G#+:E#3:C#+")
+
+    Returns:
+      ParsedNote: the parsed note, or None if the token is not valid (the
+      slow parser reports the exact error)
     """
-    tracks = {}
-    current = None
-    for line in lines:        
-        if line['text'].startswith("Track"):
-            nm = line['text'][6:]
-            current = []
-            tracks[nm] = current
-        else:
-            if current is not None:
-                current.append(line)  
-    print('>>>',tracks.keys())
-    return tracks
+    ret = _PARSED_NOTES.get(text)
+    if ret is not None:
+        return ret
+    m = NOTE_PATTERN.fullmatch(text)
+    if not m:
+        return None
+    accent,length,dots,plet,tie,name,accidental,octave,moves,others = m.groups()
+    if (dots or plet) and not length:
+        return None
+    raw = [(name,accidental,octave,moves)]
+    raw.extend(p.groups() for p in PITCH_PATTERN.finditer(others))
+    for pitch in raw:
+        # Rests have no accidental or octave, and cannot be parallel
+        if pitch[0]=='R' and (pitch[1] or pitch[2] or pitch[3] or len(raw)>1):
+            return None
+    pitches = [_make_pitch(*pitch) for pitch in raw]
+    if length:
+        ret = ParsedNote(accent,int(length),len(dots),plet or None,tie=='~',tuple(pitches))
+    else:
+        ret = ParsedNote(accent,None,None,None,tie=='~',tuple(pitches))
+    if len(_PARSED_NOTES)<_MAX_PARSED_NOTES:
+        _PARSED_NOTES[text] = ret
+    return ret
+
+def tokenize_line(text):
+    """Split a line of music into note tokens and parse each
+
+    Args:
+      text (str): the line (comments already removed)
+
+    Returns:
+      list: (token, ParsedNote or None) for each note on the line
+    """
+    return [(token,tokenize_note(token)) for token in text.replace('|','').split()]
+
+def apply_note(note,info):
+    """Update the parser state with a parsed note
+
+    Lengths and octaves that the note leaves out come from the state.
+
+    Args:
+      note (ParsedNote): the parsed note
+      info (NoteState): the parser state
+    """
+    if note.len is not None:
+        info.note_len = note.len
+        info.note_dots = note.dots
+        info.note_plet = note.plet
+    note_octave = info.note_octave
+    note_pitches = []
+    for note_name,note_accidental,absolute,offset in note.pitches:
+        if absolute is not None:
+            note_octave = absolute
+        note_octave += offset
+        note_pitches.append((note_name,note_accidental,note_octave))
+    info.note_octave = note_octave
+    info.note_accent = note.accent
+    info.note_tie = note.tie
+    info.note_pitches = note_pitches
 
 def parse_note(text,info,err_text=None):
+    """Parse one note token and update the parser state with it
+
+    Args:
+      text (str): the note token
+      info (NoteState): the parser state
+      err_text (str): the text to show in errors (defaults to the token)
+    """
+    note = tokenize_note(text)
+    if note is None:
+        # Not valid. The step-by-step parser finds the exact problem.
+        _parse_note_checked(text,info,err_text)
+    else:
+        apply_note(note,info)
+
+def _parse_note_checked(text,info,err_text=None):
    
     # For errors
     if err_text is None:
@@ -102,9 +192,9 @@ def parse_note(text,info,err_text=None):
     if note_len:
         note_len = int(note_len)        
     else:
-        note_len = info['note_len']
-        note_dots = info['note_dots']
-        note_plet = info['note_plet']
+        note_len = info.note_len
+        note_dots = info.note_dots
+        note_plet = info.note_plet
    
     # Now for the pitch(es)
 
@@ -134,7 +224,7 @@ def parse_note(text,info,err_text=None):
             note_octave += note_right[0]
             note_right = note_right[1:]
         if note_octave == '':
-            note_octave = info['note_octave']
+            note_octave = info.note_octave
         else:
             if note_name=='R':            
                 raise Exception('Rests do not have octaves "'+pitch+'" in "'+err_text+'"')
@@ -151,7 +241,7 @@ def parse_note(text,info,err_text=None):
         if note_right:            
             raise Exception('Invalid syntax right of note name "'+pitch+'" in "'+err_text+'"')
         note_pitches.append((note_name,note_accidental,note_octave))
-        info['note_octave'] = note_octave
+        info.note_octave = note_octave
 
         if note_name=='R':            
             if note_accidental:
@@ -163,13 +253,13 @@ def parse_note(text,info,err_text=None):
                 raise Exception('Rests not allowed in parallel notes "'+err_text+'"')          
 
     # Update the defaults for the next note to access
-    #info['note_octave'] = note_octave # Done in the pitch loop
-    info['note_len'] = note_len        
-    info['note_dots'] = note_dots
-    info['note_plet'] = note_plet
-    info['note_accent'] = note_accent
-    info['note_tie'] = note_tie
-    info['note_pitches'] = note_pitches    
+    #info.note_octave = note_octave # Done in the pitch loop
+    info.note_len = note_len        
+    info.note_dots = note_dots
+    info.note_plet = note_plet
+    info.note_accent = note_accent
+    info.note_tie = note_tie
+    info.note_pitches = note_pitches    
 
 NOTE_VALUES = { # offsets within an octave            
                'C':0,
@@ -181,6 +271,24 @@ NOTE_VALUES = { # offsets within an octave
                'B':11,              
                }
 
+def _compute_midi_note_number(note_name,note_accidental,note_octave):
+    note_octave += 1    
+    ret = note_octave * 12 + NOTE_VALUES[note_name]
+    if note_accidental == '#':
+        ret += 1
+    elif note_accidental == 'b':
+        ret -= 1
+    return ret
+
+# (note_name, note_accidental, note_octave) -> midi note number for the midi
+# octaves -1 through 9. Others are added as they are seen.
+MIDI_NOTE_NUMBERS = {
+    (name,accidental,octave) : _compute_midi_note_number(name,accidental,octave)
+    for name in NOTE_VALUES
+    for accidental in (None,'#','b','n')
+    for octave in range(-1,10)
+}
+
 def get_midi_note_number(note_name,note_accidental,note_octave):
     """Combine octave, note-name, and accidentals to get the midi note number
 
@@ -188,12 +296,44 @@ def get_midi_note_number(note_name,note_accidental,note_octave):
     Midi note 120 is C9. Our input system doesn't support negative numbers, but
     you can specify octave "-1" with "0-".
     """
-    note_octave += 1    
-    ret = note_octave * 12 + NOTE_VALUES[note_name]
-    if note_accidental == '#':
-        ret += 1
-    elif note_accidental == 'b':
-        ret -= 1
+    key = (note_name,note_accidental,note_octave)
+    ret = MIDI_NOTE_NUMBERS.get(key)
+    if ret is None:
+        ret = _compute_midi_note_number(note_name,note_accidental,note_octave)
+        MIDI_NOTE_NUMBERS[key] = ret
+    return ret
+
+# (note_len, note_dots, note_plet, ticksPerWhole, noteOnPercent) -> ticks
+# (see get_note_ticks). The settings are part of the key, so changing the
+# resolution or the on/off split never finds an old entry.
+NOTE_TICKS = {}
+
+def get_note_ticks(note_len,note_dots,note_plet,ticks_per_whole,note_on_percent):
+    """Return the number of ticks for a note (from the table when possible)
+
+    Each dot adds half of the length added before it (a dotted quarter is
+    a quarter plus an eighth, double dotted adds a sixteenth more).
+
+    Returns:
+      tuple: (total ticks, ticks the note is on, ticks the note is off)
+    """
+    key = (note_len,note_dots,note_plet,ticks_per_whole,note_on_percent)
+    ret = NOTE_TICKS.get(key)
+    if ret is None:
+        bl = note_len
+        if note_plet == 't':
+            bl = int(bl * 3 / 2)
+        elif note_plet == 'd':
+            bl = int(bl * 2 / 3)
+        length = ticks_per_whole / bl
+        add = length
+        for _ in range(note_dots):
+            add = add/2
+            length = length + add
+        len_on = int(length * note_on_percent)
+        len_off = int(length - len_on)
+        ret = (int(length),len_on,len_off)
+        NOTE_TICKS[key] = ret
     return ret
 
 def process_note(info,previous_note,wait_before,events):
@@ -202,87 +342,114 @@ def process_note(info,previous_note,wait_before,events):
 
     # First, the duration (on and off)
 
-    LOGGER.debug(f'wait_before:{wait_before} info: {info}')
+    LOGGER.debug('wait_before:%s info: %s',wait_before,info)
 
-    bl = info['note_len']
-    if info['note_plet'] == 't':
-        bl = int(bl * 3 / 2)
-    elif info['note_plet'] == 'd':
-        bl = int(bl * 2 / 3)
-    note_len = info['ticksPerWhole'] / bl
-
-    # TODO handle multiple dots
-    if info['note_dots']:
-        note_len = note_len + note_len/2
+    note_len,len_on,len_off = get_note_ticks(info.note_len,info.note_dots,info.note_plet,
+                                             info.ticksPerWhole,info.noteOnPercent)
 
     # Second, the volume
 
     # TODO apply accents
     # TODO caller needs to keep up with increase/decrease volume over time
-    velocity = int(info['volume']*127)
+    velocity = int(info.volume*127)
 
     # If this is a rest, we just accumulate the total time    
    
     # TODO apply staccato, etc
-    if info['note_pitches'][0][0]=='R':
-        return int(note_len) + wait_before          
+    pitches = info.note_pitches
+    if pitches[0][0]=='R':
+        return note_len + wait_before          
 
-    # Number of ticks the note is on and off
-    len_on = int(note_len * info['noteOnPercent'])
-    len_off = int(note_len - len_on)
+    notes = [get_midi_note_number(*pitch) for pitch in pitches]
+    channel = info.channel
 
     # If the last note was tied into this one, then there was already a noteOn. No
     # need for that now. Otherwise generate noteOn events for this note.
    
-    if previous_note and previous_note['note_tie']:
+    if previous_note and previous_note.tie:
         # print('Last note was tied into this ... no noteOns')
         pass
     else:
         # All notes on
-        for note_name,note_accidental,note_octave in info['note_pitches']:
-            note = get_midi_note_number(note_name,note_accidental,note_octave)
-            events.append(MIDIChannelNoteEvent(wait_before,info['channel'],True,note,velocity))
+        for note in notes:
+            events.append(MIDIChannelNoteEvent(wait_before,channel,True,note,velocity))
             wait_before = 0 # Reset time-till-next-event
 
     # If this note is tied into the next, then we accumulate the time just like
     # we did a rest (but after we turned notes on if needed)
 
-    if info['note_tie']:
+    if info.note_tie:
         # print('This note is tied into next ... just accumulate')
-        return int(note_len) + wait_before
+        return note_len + wait_before
 
     # Looks like this note is not tied to the next. We need to generate noteOff events here.
 
     # print('This note is not tied into next ... turn off the events')
     # All notes off    
-    for note_name,note_accidental,note_octave in info['note_pitches']:
-        note = get_midi_note_number(note_name,note_accidental,note_octave)
-        events.append(MIDIChannelNoteEvent(wait_before+len_on,info['channel'],False,note,0))        
+    for note in notes:
+        events.append(MIDIChannelNoteEvent(wait_before+len_on,channel,False,note,0))        
         len_on = 0
         wait_before = 0
-        first = False
 
     return len_off
 
-def process_track(name,track):    
-    ret = [] # List of midi events
+class NoteState:
+    """The parser state of a track
+
+    The settings (channel, tempo, ...) change with special commands. The
+    note attributes (length, octave, ...) are updated by every note and
+    carry over into the next note where the music leaves them out.
+    """
 
-    note_info = {  
-        'channel' : 0,            # Can be changed per-track
-        'tempo'   : 120,          # By default, midi is 120 beats (quarter notes) per minute
-        'volume'  : 0.80,         # 80% without accent          
-        'noteOnPercent' : 0.80,   # Normal on/off time of a note
-        'ticksPerWhole' : 256*4,  # Plenty of resoultion with 256 ticks per beat (quarter note)
+    __slots__ = (
+        'channel',        # Can be changed per-track
+        'tempo',          # By default, midi is 120 beats (quarter notes) per minute
+        'volume',         # 80% without accent
+        'noteOnPercent',  # Normal on/off time of a note
+        'ticksPerWhole',  # Plenty of resoultion with 256 ticks per beat (quarter note)
         # Length attributes can carry between notes
-        'note_len' : 4,           # Music input default is quarter note
-        'note_dots' : 0,          # Number of dots (none by default)
-        'note_plet' : '',         # Triplets and duplets (none by default)        
+        'note_len',       # Music input default is quarter note
+        'note_dots',      # Number of dots (none by default)
+        'note_plet',      # Triplets and duplets (none by default)
         # Octave can carry between notes
-        'note_octave' : 4,
-        # These are specified by every note        
-        'note_tie' : False,
-        'note_pitches': None, # (note_name, note_accidental, note_octave)
-    }
+        'note_octave',
+        # These are specified by every note
+        'note_accent',
+        'note_tie',
+        'note_pitches',   # (note_name, note_accidental, note_octave)
+    )
+
+    def __init__(self):
+        self.channel = 0
+        self.tempo = 120
+        self.volume = 0.80
+        self.noteOnPercent = 0.80
+        self.ticksPerWhole = 256*4
+        self.note_len = 4
+        self.note_dots = 0
+        self.note_plet = ''
+        self.note_octave = 4
+        self.note_accent = ''
+        self.note_tie = False
+        self.note_pitches = None
+
+    def as_dict(self):
+        """Return the state as a dict of attribute name to value"""
+        return {name:getattr(self,name) for name in NoteState.__slots__}
+
+    def __repr__(self):
+        return f'NoteState({self.as_dict()})'
+
+# What the next note needs to know about the note before it
+PreviousNote = namedtuple('PreviousNote','tie pitches')
+
+# The parser state at the start of every track
+DEFAULT_NOTE_INFO = NoteState().as_dict()
+
+def process_track(name,track):    
+    ret = [] # List of midi events
+
+    note_info = NoteState()
 
     # Add the name of the track to the MIDI file (this is just informative)
     data = []
@@ -297,16 +464,16 @@ def process_track(name,track):
         if text.startswith(':'):
             if text.lower().startswith(':channel'):
                 ch = int(text[9:].strip())
-                note_info['channel'] = ch
+                note_info.channel = ch
             # Special music commands
             elif text.lower().startswith(':voice'):
                 prg = int(text[7:].strip())
-                evt  = MIDIChannelProgramChangeEvent(0,note_info['channel'],prg)
+                evt  = MIDIChannelProgramChangeEvent(0,note_info.channel,prg)
                 ret.append(evt)
             elif text.lower().startswith(':tempo'):
                 i = text.find('=')
-                note_info['tempo'] = int(text[i+1:].strip())
-                dv = 60_000_000 // note_info['tempo']
+                note_info.tempo = int(text[i+1:].strip())
+                dv = 60_000_000 // note_info.tempo
                 a = (dv>>16) & 0xFF
                 b = (dv>>8) & 0xFF
                 c = (dv) & 0xFF
@@ -314,75 +481,239 @@ def process_track(name,track):
                 ret.append(evt)
             elif text.lower().startswith(':volume'):
                 vol = int(text[8:].strip())
-                evt  = MIDIChannelControlChangeEvent(0,note_info['channel'],7,vol)
+                evt  = MIDIChannelControlChangeEvent(0,note_info.channel,7,vol)
                 ret.append(evt)
             else:
                 raise Exception('Unknown "'+text+'"')
         else:
-            notes = text.replace('|','').split()
-            for note in notes:
-                parse_note(note,note_info)
+            for token,note in tokenize_line(text):
+                if note is None:
+                    _parse_note_checked(token,note_info)
+                else:
+                    apply_note(note,note_info)
                 wait_before = process_note(note_info,previous_note,wait_before,ret)
-                previous_note = dict(note_info) # Make a copy of the last note
+                previous_note = PreviousNote(note_info.note_tie,note_info.note_pitches)
            
     return ret
 
-def _process(raw_lines):
+def iter_music_lines(lines,filename=None):
+    """Number the lines of a music file (lazily)
 
-    ret = MIDIFile()
-    ret.format = 1
-    ret.divis = 256
+    Args:
+      lines: any iterable of text lines (an open file, sys.stdin, a list, ...)
+      filename (str): the name to report in the line records
 
-    # Start in Track 0 by default
-    lines = [{'file':None,'line_number':0,'original_text':'Track 0','text':'Track 0'}]    
+    Yields:
+      dict: file, line_number, and original_text of each line
+    """
+    line_number = 0
+    for line in lines:
+        line_number+=1
+        yield {'file':filename,'line_number':line_number,'original_text':line.rstrip('\r\n')}
+
+def iter_tracks(raw_lines):
+    """Split music lines into tracks (lazily, one track at a time)
 
+    Comments and blank lines are dropped. Only the lines of the current
+    track are held.
+
+    Args:
+      raw_lines: iterable of line dicts (see iter_music_lines)
+
+    Yields:
+      tuple: (track name, list of the track's line dicts)
+    """
+    # Start in Track 0 by default
+    name = '0'
+    track = []
     for line in raw_lines:
         text = line['original_text']        
         i = text.find(';')
         if i>=0:
             text = text[:i]  
         text = text.strip()        
+        if not text:
+            continue
         line['text'] = text          
-        if text:
-            lines.append(line)              
-   
-    tracks = pull_tracks(lines)        
-           
-    ret.tracks = []    
-    for name,track in tracks.items():
-        track = process_track(name,track)
-        track.append(MetaEvent(0,0x2F,[])) # End of Track
-        ret.tracks.append(track)            
+        if text.startswith("Track"):
+            yield name,track
+            name = text[6:]
+            track = []
+        else:
+            track.append(line)
+    yield name,track
+
+def compile_tracks(raw_lines,cache=None,workers=None):
+    """Compile music lines into tracks of MIDI events (lazily)
+
+    A track name that appears again replaces the earlier track (but keeps
+    its place), so callers collect the results by name.
+
+    With more than one worker, the tracks are compiled at the same time in
+    worker processes. They are still yielded in the order of the score, and
+    the events are the same as compiling them one after another.
+
+    Args:
+      raw_lines: iterable of line dicts (see iter_music_lines)
+      cache (TrackCache): if given, unchanged tracks are taken from the cache
+      workers (int): number of worker processes (None or 1 to compile here)
+
+    Yields:
+      tuple: (track name, list of events ending with the END OF TRACK event)
+    """
+    if workers is not None and workers>1:
+        yield from _compile_tracks_parallel(raw_lines,cache,workers)
+        return
+    for name,track in iter_tracks(raw_lines):
+        with midi_stats.phase('compile_track',track=name) as stats_info:
+            if cache is None:
+                events = process_track(name,track)
+            else:
+                key = cache.key(name,[line['text'] for line in track],DEFAULT_NOTE_INFO)
+                events = cache.get(key)
+                if events is None:
+                    events = process_track(name,track)
+                    cache.put(key,events)
+            events.append(MetaEvent(0,0x2F,[])) # End of Track
+            stats_info['events'] = events
+        yield name,events
+
+def _compile_tracks_parallel(raw_lines,cache,workers):
+    # Every track is handed to the pool as it is read. Cache hits don't go to
+    # the pool at all. The results are collected in score order.
+    pending = [] # (name, key, events or future)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name,track in iter_tracks(raw_lines):
+            key = None
+            events = None
+            if cache is not None:
+                key = cache.key(name,[line['text'] for line in track],DEFAULT_NOTE_INFO)
+                events = cache.get(key)
+            if events is None:
+                events = pool.submit(process_track,name,track)
+            pending.append((name,key,events))
+        for name,key,events in pending:
+            with midi_stats.phase('compile_track',track=name) as stats_info:
+                if not isinstance(events,list):
+                    events = events.result()
+                    if cache is not None:
+                        cache.put(key,events)
+                events.append(MetaEvent(0,0x2F,[])) # End of Track
+                stats_info['events'] = events
+            yield name,events
+
+def compile_music_to(lines,f,filename=None,cache=None,running_status=False,report=None,workers=None):
+    """Compile music lines straight to a MIDI file
+
+    Each track is encoded to bytes as soon as it is compiled, and its events
+    are dropped. Only the encoded tracks are kept until the file is written
+    (the header needs the number of tracks).
+
+    Args:
+      lines: any iterable of text lines (an open file, sys.stdin, a list, ...)
+      f: a binary file-like object to write the MIDI data to
+      filename (str): the name of the source (for the line records)
+      cache (TrackCache): if given, unchanged tracks are taken from the cache
+      running_status (bool): compress the tracks with running status
+      report (list): if given, the number of bytes saved in each track is appended
+      workers (int): compile the tracks in this many worker processes (see compile_tracks)
+
+    Returns:
+      int: the number of tracks written
+    """
+    midi = MIDIFile()
+    encoded = {}
+    saved = {}
+    for name,events in compile_tracks(iter_music_lines(lines,filename),cache,workers):
+        with midi_stats.phase('encode_track',events=events) as stats_info:
+            encoded[name],saved[name] = midi.encode_track(events,running_status)
+            stats_info['bytes'] = len(encoded[name])
+    if report is not None:
+        report.extend(saved.values())
+    data = MIDIFile.pack_file(1,256,list(encoded.values()))
+    with midi_stats.phase('write',bytes=len(data)):
+        f.write(data)
+    return len(encoded)
+
+def _process(raw_lines,cache=None,workers=None):
+    """Compile the lines of a music file into a MIDIFile
+
+    Args:
+      raw_lines: iterable of line dicts (see iter_music_lines)
+      cache (TrackCache): if given, unchanged tracks are taken from the cache
+      workers (int): compile the tracks in this many worker processes (see compile_tracks)
+    """
+
+    ret = MIDIFile()
+    ret.format = 1
+    ret.divis = 256
+
+    tracks = {}
+    for name,events in compile_tracks(raw_lines,cache,workers):
+        tracks[name] = events
+    ret.tracks = list(tracks.values())
        
     return ret
 
-def process_music_file(filename):
-    raw_lines = []
-    line_number = 0
+def process_music_file(filename,cache=None,workers=None):
     with open(filename) as f:
-        for line in f:
-            line_number+=1
-            raw_lines.append({'file':filename,'line_number':line_number,'original_text':line.strip()})          
-    return _process(raw_lines)
+        return _process(iter_music_lines(f,filename),cache,workers)
 
-def process_music(text):
-    raw_lines = []
-    line_number = 0
-    for line in text.split('\n'):
-        line_number+=1
-        raw_lines.append({'file':None,'line_number':line_number,'original_text':line})    
-    return _process(raw_lines)
+def process_music(text,cache=None,workers=None):
+    return _process(iter_music_lines(text.split('\n')),cache,workers)
+
+def process_music_lines(lines,cache=None,workers=None):
+    """Compile any iterable of music lines (sys.stdin, a generator, ...)"""
+    return _process(iter_music_lines(lines),cache,workers)
 
 if __name__=="__main__":
 
-    # py -m music_parser input.txt output.mid -printMidi
+    # py -m music_parser input.txt output.mid [-printMidi] [-runningStatus] [-cache DIR] [-workers N]
+    #                    [-stats] [-profile FILE] [-tracemalloc FILE]
+    # Use "-" for the input to read stdin and "-" for the output to write stdout.
 
     logging.basicConfig(level='INFO')
-       
-    ret = process_music_file(sys.argv[1])
-
-    print("NumTracks=%d Format=%d Division=%d" % (len(ret.tracks),ret.format,ret.divis))
-    if len(sys.argv)>3 and sys.argv[3]=='-printMidi':
-        midi_diss.print_tracks(ret.tracks)        
 
-    ret.write_file(sys.argv[2])
\ No newline at end of file
+    argv,stats_options = midi_stats.extract_options(sys.argv)
+    options = argv[3:]
+    cache = None
+    if '-cache' in options:
+        cache = TrackCache(options[options.index('-cache')+1])
+    running_status = '-runningStatus' in options
+    workers = None
+    if '-workers' in options:
+        workers = int(options[options.index('-workers')+1])
+    # The summary (and the -printMidi listing) goes to stderr when the MIDI data goes to stdout
+    info_out = sys.stderr if argv[2]=='-' else sys.stdout
+
+    # The MIDI data is made in memory and only written once the compile
+    # worked, so an error never leaves a broken (or emptied) output file
+    source = sys.stdin if argv[1]=='-' else open(argv[1])
+    data = io.BytesIO()
+    try:
+        with midi_stats.instrumented(stats_options):
+            saved = []
+            if '-printMidi' in options:
+                ret = _process(iter_music_lines(source,argv[1]),cache,workers)
+                print("NumTracks=%d Format=%d Division=%d" % (len(ret.tracks),ret.format,ret.divis),file=info_out)
+                midi_diss.print_tracks(ret.tracks,info_out)
+                ret.write_to(data,running_status,saved)
+            else:
+                num_tracks = compile_music_to(source,data,argv[1],cache,running_status,saved,workers)
+                print("NumTracks=%d Format=%d Division=%d" % (num_tracks,1,256),file=info_out)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    if argv[2]=='-':
+        sys.stdout.buffer.write(data.getvalue())
+        sys.stdout.buffer.flush()
+    else:
+        tmp = argv[2]+'.tmp'
+        with open(tmp,'wb') as f:
+            f.write(data.getvalue())
+        os.replace(tmp,argv[2])
+
+    if running_status:
+        for tn,count in enumerate(saved):
+            LOGGER.info(f'Track {tn}: running status saved {count} bytes')
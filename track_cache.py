@@ -0,0 +1,147 @@
+"""
+MIT License
+
+Copyright (c) 2022 Chris Cantrell
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from midi_file import MIDIFile, MIDIDataCursor
+from cache_directory import CacheDirectory
+
+"""A cache of compiled music tracks (see music_parser)"""
+
+class TrackCache:
+    """Compiled tracks keyed by a hash of their source
+
+    The key covers the track name, the text of every line in the track, and
+    the parser state the track starts with. Any change to those means a new
+    key. The value is the encoded MIDI events of the track (the body of the
+    MTrk chunk).
+
+    Tracks are kept in memory (for repeated compiles in one process) and, if
+    a directory is given, in one file per track on disk. The disk cache is
+    kept under max_bytes by deleting the least recently used files.
+    """
+
+    # Change this when the compiler changes the events it makes for the same source
+    VERSION = 2
+
+    EXTENSION = '.trk'
+
+    def __init__(self,directory=None,max_bytes=64*1024*1024,max_memory_entries=256):
+        """
+        Args:
+          directory (str): where to keep the cache files (None for memory only)
+          max_bytes (int): the most disk space the cache files may use
+          max_memory_entries (int): the most tracks to keep in memory
+        """
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.files = CacheDirectory(directory,TrackCache.EXTENSION,max_bytes) if directory else None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self,name,lines,state):
+        """Make the key for a track
+
+        Args:
+          name (str): the name of the track
+          lines (list): the text of each line of the track
+          state (dict): the parser state at the start of the track
+
+        Returns:
+          str: the hex digest
+        """
+        h = hashlib.sha256()
+        h.update(f'{TrackCache.VERSION}\n{name}\n'.encode())
+        h.update(repr(sorted(state.items())).encode())
+        for line in lines:
+            h.update(b'\n')
+            h.update(line.encode())
+        return h.hexdigest()
+
+    def get(self,key):
+        """Return the events of a cached track
+
+        Args:
+          key (str): the track's key
+
+        Returns:
+          list: the events, or None if the track is not in the cache
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+        elif self.files:
+            filename = self.files.filename(key)
+            try:
+                with open(filename,'rb') as f:
+                    data = f.read()
+                self.files.touch(filename)
+            except OSError:
+                data = None
+            if data is not None:
+                self._remember(key,data)
+        if data is None:
+            self.misses += 1
+            return None
+        try:
+            events = list(MIDIFile().decode_events(MIDIDataCursor(data),len(data)))
+        except Exception:
+            # A damaged (or truncated) entry is dropped and treated as a miss. The
+            # decoder raises IndexError, ValueError, struct.error or a plain Exception.
+            self.discard(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return events
+
+    def discard(self,key):
+        """Remove a track from the cache (memory and disk)
+
+        Args:
+          key (str): the track's key
+        """
+        self.memory.pop(key,None)
+        if self.files:
+            self.files.remove(self.files.filename(key))
+
+    def put(self,key,events):
+        """Add the events of a compiled track to the cache
+
+        Args:
+          key (str): the track's key
+          events (list): the events of the track
+        """
+        data,_ = MIDIFile().encode_track(events)
+        data = bytes(data)
+        self._remember(key,data)
+        if self.files:
+            self.files.write(self.files.filename(key),data)
+
+    def _remember(self,key,data):
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        while len(self.memory)>self.max_memory_entries:
+            self.memory.popitem(last=False)